@@ -0,0 +1,291 @@
+import numpy as np
+import pandas as pd
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from main import (OPTIONS_NAMES, DEFAULT_PARAMETERS, DiskCache, GroupPool, load_csv, select_columns, clean_data, average_groups,
+                  process_groups, peak_stats, build_output, plot_processed_data)
+
+REPORT_VERSION = 1
+
+# Each scenario is a synthetic export: frames, total columns (Average, C0 and the P columns), generated peaks and
+# the standard deviation of the per-column noise in strain. The wizard's defaults assume roughly 1% elongation plateaus
+SCENARIOS = {
+    "quick": [
+        {"name": "pogo-1k", "frames": 1000, "columns": 15, "peaks": 8, "noise": 0.0002},
+        {"name": "pogo-10k", "frames": 10000, "columns": 15, "peaks": 20, "noise": 0.0002},
+        {"name": "pogo-100k", "frames": 100000, "columns": 15, "peaks": 50, "noise": 0.0002},
+        {"name": "wide-10k", "frames": 10000, "columns": 500, "peaks": 20, "noise": 0.0002},
+        {"name": "noisy-100k", "frames": 100000, "columns": 15, "peaks": 50, "noise": 0.0005},
+        {"name": "many-peaks-100k", "frames": 100000, "columns": 15, "peaks": 2000, "noise": 0.0002},
+    ],
+    "full": [
+        {"name": "pogo-1m", "frames": 1000000, "columns": 15, "peaks": 200, "noise": 0.0002},
+        {"name": "pogo-10m", "frames": 10000000, "columns": 15, "peaks": 1000, "noise": 0.0002},
+        {"name": "wide-10k-5000", "frames": 10000, "columns": 5000, "peaks": 20, "noise": 0.0002},
+        {"name": "wide-100k-1000", "frames": 100000, "columns": 1000, "peaks": 50, "noise": 0.0002},
+        {"name": "noisy-1m", "frames": 1000000, "columns": 15, "peaks": 200, "noise": 0.0005},
+    ],
+}
+SCENARIOS["full"] = SCENARIOS["quick"] + SCENARIOS["full"]
+
+# Modules main.py must not import until a page needs them, so the first window shows without waiting for them
+DEFERRED_MODULES = ["pandas", "matplotlib", "pyperclip"]
+STARTUP_SCRIPT = (
+    "import sys, time, json\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "print(json.dumps({'seconds': time.perf_counter() - start, 'loaded': [name for name in %r if name in sys.modules]}))\n"
+) % DEFERRED_MODULES
+
+# --- Synthetic data ---
+# Noise free strain of a pogo test: each cycle ramps up over a few frames, holds a plateau, ramps down and rests at zero.
+# Plateau heights vary between cycles the way they do between load steps
+def dic_signal(frames, peaks, t):
+    period = frames / peaks
+    cycle = np.minimum((t // period).astype(np.int64), peaks - 1)
+    phase = t - cycle * period
+
+    ramp = max(min(period / 20, 4), 1)
+    hold = period / 2
+    heights = 0.01 + 0.02 * np.random.default_rng(peaks).random(peaks)
+
+    shape = np.clip(np.minimum(phase / ramp, (ramp + hold - phase) / ramp + 1), 0, 1)
+    return heights[cycle] * shape
+
+# Writes a csv in the DIC software's export format: a BOM, a header row of point names, a row of quantity names, then one row per frame
+def generate_csv(path, frames, columns, peaks, noise, seed=0, chunksize=100000):
+    rng = np.random.default_rng(seed)
+    names = ["Average", "C0"] + ["P" + str(i) for i in range(columns - 2)]
+    gains = 1 + 0.05 * rng.standard_normal(columns - 1)
+
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(",".join('"' + name + '"' for name in names) + "\n")
+        f.write(",".join(['"e1 [1] - Lagrange"'] * columns) + "\n")
+
+        for start in range(0, frames, chunksize):
+            t = np.arange(start, min(start + chunksize, frames), dtype=float)
+            points = dic_signal(frames, peaks, t)[:, None] * gains + noise * rng.standard_normal((len(t), columns - 1))
+            values = np.column_stack((points.mean(axis=1), points))
+            pd.DataFrame(values).to_csv(f, header=False, index=False, float_format="%.6g")
+
+# Generated files are kept in data_dir and reused as long as the scenario did not change
+def scenario_csv(scenario, data_dir):
+    name = "{name}_{frames}x{columns}_{peaks}p_{noise}.csv".format(**scenario)
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        generate_csv(path + ".tmp", scenario["frames"], scenario["columns"], scenario["peaks"], scenario["noise"])
+        os.replace(path + ".tmp", path)
+    return path
+
+# Three groups splitting the P columns like a user would pick top, middle and bottom points
+def scenario_groups(columns):
+    points = np.arange(2, columns)
+    return [list(group) for group in np.array_split(points, 3)], ["Top", "Middle", "Bottom"]
+
+# Up to count overlapping neighbourhoods of width points, one starting at every point, the way noisy speckle points are smoothed
+def overlapping_groups(columns, width=9, count=300):
+    starts = range(2, max(columns - width, 2) + 1)[:count]
+    return [list(range(start, min(start + width, columns))) for start in starts]
+
+# --- Timing ---
+# Best and median wall time of repeats calls, the result of the last call is returned with them
+def time_stage(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": float(np.median(times))}, result
+
+# Time to import main.py in a fresh interpreter, which is what delays the first window
+def measure_startup(repeats):
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        startup = json.loads(result.stdout)
+        times.append(startup["seconds"])
+    return {"min": min(times), "median": float(np.median(times)), "loaded": startup["loaded"]}
+
+def run_scenario(scenario, data_dir, repeats):
+    path = scenario_csv(scenario, data_dir)
+    all_columns, column_names = scenario_groups(scenario["columns"])
+    parameters = dict(DEFAULT_PARAMETERS)
+    stages = {}
+
+    stages["load_csv"], (df, _) = time_stage(lambda: load_csv(path), repeats)
+
+    # The first load writes the sidecar, only the loads that map it are timed. Every scenario's sidecars are kept like its csv
+    disk = DiskCache(os.path.join(data_dir, "sidecars"), max_bytes=float("inf"))
+    load_csv(path, disk)
+    stages["load_sidecar"], _ = time_stage(lambda: load_csv(path, disk), repeats)
+
+    def gen_dfs():
+        columns, groups = select_columns(all_columns)
+        return average_groups(clean_data(df, columns), groups, column_names)
+    stages["gen_dfs"], processed_df = time_stage(gen_dfs, repeats)
+
+    stages["process_data"], processed_data = time_stage(lambda: process_groups(processed_df, parameters), repeats)
+
+    # Hundreds of overlapping groups combined at once with each kind of aggregation
+    overlapping = overlapping_groups(scenario["columns"])
+    columns, groups = select_columns(overlapping)
+    df_clean = clean_data(df, columns)
+    names = [str(i) for i in range(len(groups))]
+    for stage, aggregation in [("overlap_mean", "mean"), ("overlap_median", "median"), ("overlap_trim", "trim:20")]:
+        stages[stage], _ = time_stage(lambda df_clean=df_clean, aggregation=aggregation: average_groups(
+            df_clean, groups, names, [aggregation] * len(groups)), repeats)
+    del df_clean
+
+    # The same averaging and detection on worker processes reading the cleaned matrix from shared memory
+    def group_pool():
+        columns, groups = select_columns(all_columns)
+        pool = GroupPool(clean_data(df, columns), groups)
+        try:
+            process_groups(pool.average(column_names), parameters, pool=pool)
+        finally:
+            pool.close()
+    stages["group_pool"], _ = time_stage(group_pool, repeats)
+    peak_counts = [len(group[1]) for group in processed_data]
+
+    # The output table needs the same number of peaks in every group, noisy scenarios may split a few plateaus
+    output_peaks = min(peak_counts)
+    matched = [(group[0], group[1][:output_peaks]) for group in processed_data]
+
+    stages["find_stats"], _ = time_stage(lambda: [peak_stats(data, peaks, OPTIONS_NAMES) for data, peaks in matched], repeats)
+
+    def plot():
+        fig, _ = plot_processed_data(processed_data, scenario["name"])
+        FigureCanvasAgg(fig).draw()
+    stages["plot"], _ = time_stage(plot, repeats)
+
+    def export():
+        output_data = build_output(matched, column_names, OPTIONS_NAMES)
+        output_data.to_csv(io.StringIO(), index=False)
+    stages["export"], _ = time_stage(export, repeats)
+
+    return {
+        "frames": scenario["frames"],
+        "columns": scenario["columns"],
+        "peaks": scenario["peaks"],
+        "noise": scenario["noise"],
+        "file_mb": os.path.getsize(path) / 1024**2,
+        "detected_peaks": peak_counts,
+        "stages": stages,
+    }
+
+def run_benchmarks(scenarios, data_dir, repeats):
+    report = {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+                    "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__},
+        "repeats": repeats,
+        "startup": measure_startup(repeats),
+        "scenarios": {},
+    }
+    print(f"startup: import main {report['startup']['min']*1000:.1f} ms", file=sys.stderr)
+
+    for scenario in scenarios:
+        print(f"{scenario['name']}: {scenario['frames']} frames x {scenario['columns']} columns", file=sys.stderr)
+        result = run_scenario(scenario, data_dir, repeats)
+        report["scenarios"][scenario["name"]] = result
+        print("  " + ", ".join(f"{stage} {times['min']*1000:.1f} ms" for stage, times in result["stages"].items()), file=sys.stderr)
+
+    return report
+
+# --- Baseline comparison ---
+# A stage regresses when its best time is more than threshold times the baseline's and slower by at least min_delta seconds,
+# so timer noise on stages that take a few milliseconds never fails the run
+def compare_reports(report, baseline, threshold, min_delta):
+    rows = []
+    regressions = 0
+
+    if "startup" in baseline:
+        new, old = report["startup"]["min"], baseline["startup"]["min"]
+        failed = new / old > threshold and new - old > min_delta
+        regressions += failed
+        rows.append(f"{'startup':<20} {'import main':<14} {old*1000:>10.1f} {new*1000:>10.1f} {new/old:>7.2f}x {'REGRESSION' if failed else ''}")
+
+    for name, result in report["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        base = baseline["scenarios"][name]
+
+        for stage, times in result["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            new, old = times["min"], base["stages"][stage]["min"]
+            ratio = new / old if old > 0 else float("inf")
+            failed = ratio > threshold and new - old > min_delta
+            regressions += failed
+            rows.append(f"{name:<20} {stage:<14} {old*1000:>10.1f} {new*1000:>10.1f} {ratio:>7.2f}x {'REGRESSION' if failed else ''}")
+
+        if result["detected_peaks"] != base["detected_peaks"]:
+            regressions += 1
+            rows.append(f"{name:<20} peaks changed from {base['detected_peaks']} to {result['detected_peaks']}  REGRESSION")
+
+    header = f"{'scenario':<20} {'stage':<14} {'base ms':>10} {'new ms':>10} {'ratio':>8}"
+    return "\n".join([header] + rows), regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every stage of the analysis on synthetic DIC exports.")
+    parser.add_argument("--preset", choices=SCENARIOS, default="quick", help="which scenarios to run (default: quick)")
+    parser.add_argument("--scenario", action="append", help="only run the named scenario, may be repeated")
+    parser.add_argument("--data-dir", help="where generated csvs are kept between runs (default: a folder in the temp directory)")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="timed runs of each stage, the best is compared (default: 3)")
+    parser.add_argument("-o", "--output", help="write the json report here")
+    parser.add_argument("--baseline", help="compare against this json report and exit with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio that counts as a regression (default: 1.25)")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="seconds a stage must slow down by to count as a regression (default: 0.005)")
+    parser.add_argument("--startup-budget", type=float, default=1.0, help="seconds importing main.py may take before the run fails (default: 1.0)")
+    parser.add_argument("--startup-only", action="store_true", help="only run the startup check")
+
+    args = parser.parse_args(argv)
+
+    scenarios = [] if args.startup_only else SCENARIOS[args.preset]
+    if args.scenario and not args.startup_only:
+        scenarios = [scenario for scenario in scenarios if scenario["name"] in args.scenario]
+        if not scenarios:
+            print("No scenarios matched, choose from: " + ", ".join(s["name"] for s in SCENARIOS[args.preset]), file=sys.stderr)
+            return 2
+
+    data_dir = args.data_dir if args.data_dir else os.path.join(tempfile.gettempdir(), "dic-benchmark")
+    os.makedirs(data_dir, exist_ok=True)
+
+    report = run_benchmarks(scenarios, data_dir, args.repeats)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    startup = report["startup"]
+    if startup["min"] > args.startup_budget or startup["loaded"]:
+        print(f"Startup over budget: importing main.py took {startup['min']:.2f}s (budget {args.startup_budget:.2f}s)"
+              + (" and loaded " + ", ".join(startup["loaded"]) if startup["loaded"] else ""), file=sys.stderr)
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        table, regressions = compare_reports(report, baseline, args.threshold, args.min_delta)
+        print(table)
+        if regressions:
+            print(f"{regressions} regression(s) against {args.baseline}", file=sys.stderr)
+            failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
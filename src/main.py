@@ -2,16 +2,236 @@ import tkinter as tk
 from tkinter import filedialog
 from tkinter import ttk
 from tkinter import Toplevel
-import matplotlib.pyplot as plt
-import pandas as pd
+import numpy as np
 import os
+import io
+import sys
+import csv
+import time
+import json
+import hashlib
+import fnmatch
+import itertools
+import argparse
+import threading
+import importlib
+import importlib.util
+import cProfile
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from abc import ABC, abstractmethod
-import pyperclip as ppc
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
+
+# Stands in for a heavy module until one of its attributes is first used, then replaces itself with the module.
+# pandas takes longer to import than the first window takes to show, so it is loaded on a background thread instead (preload)
+class LazyModule:
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return getattr(module, attr)
+
+pd = LazyModule("pandas", "pd")
+
+def preload(name):
+    threading.Thread(target=importlib.import_module, args=(name,), daemon=True).start()
 
 # --- Backend ---
-def process_data(data, step=1, change_sense=0.0015, zero_threshold=0.005):
+OPTIONS_NAMES = ["Middle", "Median", "Mean", "Maximum", "Minimum", "Std Dev", "Duration", "Area"]
+DEFAULT_PARAMETERS = {"Slope Threshold": 0.15, "Zero Threshold": 0.5, "Step": 1, "Window": 5, "Detector": "Slope"}
+
+STREAM_CHUNKSIZE = 100000
+STREAM_THRESHOLD = 512 * 1024**2
+SIDECAR_VERSION = 3
+LIVE_POLL_MS = 1000
+EXPORT_CHUNKSIZE = 100000
+EXCEL_MAX_ROWS = 1048576
+
+def process_data(data, step=1, change_sense=0.0015, zero_threshold=0.005, engine="vectorized", detector="Slope", window=5):
+    if engine == "loop":
+        return process_data_loop(data, step, change_sense, zero_threshold)
+
+    detector = DETECTORS[detector](step, change_sense, zero_threshold, window)
+    detector.feed(data.iloc[:, 0].to_numpy(dtype=float))
+    return detector.result(data)
+
+# Classify every sampled point as flat (True) or changing (False), prev_value is the sample before the first one
+def flat_samples(samples, prev_value, threshold, zero_threshold):
+    slopes = np.abs(np.diff(samples, prepend=prev_value))
+    return ~((slopes > threshold) | (samples <= zero_threshold))
+
+# Resumable version of the process_data state machine, rows can be fed in any number of chunks.
+# Other detectors only override flat() and keep any samples they need from earlier chunks themselves
+class PeakDetector:
+    description = "Compares the slope between neighbouring samples with the Slope Threshold. Window is not used."
+
+    def __init__(self, step=1, change_sense=0.0015, zero_threshold=0.005, window=5):
+        self.step = step
+        self.threshold = change_sense*step
+        self.zero_threshold = zero_threshold
+        self.window = max(int(window), 1)
+
+        self.rows = 0
+        self.last_sample = None
+        self.open_start = None
+        self.peaks = []
+
+    def feed(self, values):
+        values = np.asarray(values, dtype=float)
+
+        # Only every step-th row (counted from the very first row) is sampled
+        first_sample = -(-self.rows // self.step)
+        samples = values[first_sample*self.step - self.rows::self.step]
+        self.rows += len(values)
+        if len(samples) == 0:
+            return
+
+        flat = self.flat(samples)
+
+        was_flat = np.concatenate(([self.open_start is not None], flat[:-1]))
+        starts = (first_sample + np.flatnonzero(flat & ~was_flat)) * self.step
+        ends = (first_sample + np.flatnonzero(~flat & was_flat) - 1) * self.step
+        if self.open_start is not None:
+            starts = np.concatenate(([self.open_start], starts))
+
+        # A flat run still open at the end of the chunk becomes a peak once a later chunk closes it
+        self.peaks += zip(starts[:len(ends)].tolist(), ends.tolist())
+        self.open_start = int(starts[-1]) if flat[-1] else None
+
+    # Classify the new samples as flat (True) or changing (False)
+    def flat(self, samples):
+        prev_value = samples[0] if self.last_sample is None else self.last_sample
+        self.last_sample = samples[-1]
+        return flat_samples(samples, prev_value, self.threshold, self.zero_threshold)
+
+    # data holds the rows that were fed
+    def result(self, data):
+        return ProcessedGroup(data.iloc[:, :1], list(self.peaks), self.open_start, self.step)
+
+    # The samples kept from earlier chunks followed by the new ones, the very first sample is repeated to fill the window
+    def extend_history(self, samples, keep):
+        history = np.full(keep, samples[0]) if self.last_sample is None else self.last_sample
+        extended = np.concatenate((history, samples))
+        self.last_sample = extended[len(extended)-keep:]
+        return extended
+
+# Least squares slope over the last Window samples, one convolution for the whole chunk
+class RollingSlopeDetector(PeakDetector):
+    description = "Fits a line through the last Window samples and compares its slope with the Slope Threshold, so single noisy samples do not end a peak."
+
+    def flat(self, samples):
+        points = max(self.window, 2)
+        offsets = np.arange(points) - (points-1)/2
+        kernel = (offsets / np.square(offsets).sum())[::-1]
+
+        slopes = np.convolve(self.extend_history(samples, points-1), kernel, mode="valid")
+        return ~((np.abs(slopes) > self.threshold) | (samples <= self.zero_threshold))
+
+# Median of the last Window samples over a whole chunk, pandas keeps the window sorted as it slides instead of sorting every window
+def moving_median(extended, window):
+    return pd.Series(extended).rolling(window, min_periods=1).median().to_numpy()[window-1:]
+
+# The Slope rule applied to a moving median of the samples, which removes spikes shorter than half the window
+class MovingMedianDetector(PeakDetector):
+    description = "Replaces every sample with the median of the last Window samples before applying the Slope rule, which removes spikes shorter than half the window."
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.last_smoothed = None
+
+    def flat(self, samples):
+        smoothed = moving_median(self.extend_history(samples, self.window-1), self.window)
+        prev_value = smoothed[0] if self.last_smoothed is None else self.last_smoothed
+        self.last_smoothed = smoothed[-1]
+        return flat_samples(smoothed, prev_value, self.threshold, self.zero_threshold)
+
+# The Slope rule with the Zero Threshold measured from the group's own resting level instead of from zero.
+# The resting level is the lowest moving median seen so far, so a group whose zero has drifted still separates its peaks
+class AdaptiveZeroDetector(PeakDetector):
+    description = "Applies the Slope rule but measures the Zero Threshold from each group's resting level (the lowest median of Window samples so far), for groups that do not return to zero."
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.prev_sample = None
+        self.baseline = np.inf
+
+    def flat(self, samples):
+        smoothed = moving_median(self.extend_history(samples, self.window-1), self.window)
+        baseline = np.minimum.accumulate(np.minimum(smoothed, self.baseline))
+        self.baseline = baseline[-1]
+
+        prev_value = samples[0] if self.prev_sample is None else self.prev_sample
+        self.prev_sample = samples[-1]
+        slopes = np.abs(np.diff(samples, prepend=prev_value))
+        return ~((slopes > self.threshold) | (samples <= baseline + self.zero_threshold))
+
+# Peak detection engines selectable on Page 3, every one returns a ProcessedGroup
+DETECTORS = {
+    "Slope": PeakDetector,
+    "Rolling Slope": RollingSlopeDetector,
+    "Moving Median": MovingMedianDetector,
+    "Adaptive Zero": AdaptiveZeroDetector,
+}
+
+def parameter_detector(parameters):
+    return DETECTORS[parameters.get("Detector", DEFAULT_PARAMETERS["Detector"])](
+        parameters["Step"], parameters["Slope Threshold"], parameters["Zero Threshold"], parameters.get("Window", DEFAULT_PARAMETERS["Window"]))
+
+# What process_data returns for a group: its values and the peaks as (start, end) row intervals. It unpacks and indexes like
+# the (data, peaks) pair it replaced. The per row "flat"/"changing" labels are only built when states() is called,
+# so a session never holds a Python string per row
+class ProcessedGroup:
+    def __init__(self, data, peaks, open_start=None, step=1):
+        self.data = data
+        self.peaks = peaks
+        self.open_start = open_start
+        self.step = step
+
+    def __iter__(self):
+        return iter((self.data, self.peaks))
+
+    def __getitem__(self, i):
+        return (self.data, self.peaks)[i]
+
+    def __len__(self):
+        return 2
+
+    def states(self):
+        return interval_states(self.peaks, self.open_start, self.step, self.data.index)
+
+    # The values with a "state" column, the layout process_data used to return
+    def labeled(self):
+        out = pd.DataFrame(self.data.iloc[:, 0])
+        out["state"] = self.states()
+        return out
+
+    def nbytes(self):
+        return int(self.data.memory_usage(index=True).sum()) + 16*len(self.peaks)
+
+# Per row labels rebuilt from the flat runs, which are the peaks plus a run still open at the last sample.
+# Each sample labels the block of rows before it so rows after the last sample stay unlabeled
+def interval_states(peaks, open_start, step, index):
+    rows = len(index)
+    samples = -(-rows // step)
+
+    runs = np.array(peaks, dtype=np.int64).reshape(-1, 2) // step
+    edges = np.zeros(samples + 1, dtype=np.int64)
+    np.add.at(edges, runs[:, 0], 1)
+    np.add.at(edges, runs[:, 1] + 1, -1)
+    if open_start is not None:
+        edges[open_start // step] += 1
+    flat = np.cumsum(edges[:-1]) > 0
+
+    states = np.full(rows, None, dtype=object)
+    if samples > 1:
+        states[:(samples-1)*step] = np.repeat(np.where(flat[1:], "flat", "changing"), step)
+    return pd.Series(states, index=index, dtype=object)
+
+# Reference implementation, walks the series one sample at a time
+def process_data_loop(data, step=1, change_sense=0.0015, zero_threshold=0.005):
     out = pd.DataFrame(data.iloc[:, 0])
     out["state"] = None
 
@@ -48,28 +268,62 @@ def process_data(data, step=1, change_sense=0.0015, zero_threshold=0.005):
 
     return (out, peaks)
 
+# Keep the minimum and maximum of every pixel column, in the order they occur, so spikes stay visible
+def decimate(x, y, pixels):
+    if len(y) <= 4*pixels:
+        return x, y
+
+    per_pixel = -(-len(y) // pixels)
+    blocks = -(-len(y) // per_pixel)
+    padded = np.full(blocks*per_pixel, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(blocks, per_pixel)
+
+    offsets = np.arange(blocks) * per_pixel
+    keep = np.unique(np.concatenate((offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1))))
+    return x[keep], y[keep]
+
+# Outline of the area between a peak and the x-axis, peak_values are the group's values from peak_start to peak_end
+def peak_polygon(peak, peak_values, per_pixel):
+    x_segment, y_segment = decimate(np.arange(peak[0], peak[1]), peak_values, max(int((peak[1]-peak[0]) / per_pixel), 1))
+    return np.column_stack((
+        np.concatenate(([x_segment[0]], x_segment, [x_segment[-1]])),
+        np.concatenate(([0], y_segment, [0])),
+    ))
+
 def plot_processed_data(plot_data, title):
-    fig, ax = plt.subplots()
+    # matplotlib is only imported once the first graph is drawn
+    from matplotlib.figure import Figure
+    from matplotlib.collections import PolyCollection
+
+    # Not created through pyplot so the figure can be built off the Tk thread
+    fig = Figure()
+    ax = fig.subplots()
     colors = ['red', 'green', 'blue', 'yellow', 'black', 'purple', 'orange', 'brown']
 
+    # Nothing finer than a pixel can be seen, so lines never need more than two points per pixel column
+    pixels = int(fig.get_figwidth() * fig.dpi)
+
     group_refs = []
 
     for i, group_raw in enumerate(plot_data):
         group = group_raw[0]
         peaks = group_raw[1]
+        values = group.iloc[:, 0].to_numpy(dtype=float)
+        per_pixel = max(len(values) / pixels, 1)
 
         group_ref = []
 
-        line, = ax.plot(group.index, group.iloc[:, 0], color=colors[i%len(colors)], linewidth=1, label='Data')
+        x, y = decimate(group.index.to_numpy(), values, pixels)
+        line, = ax.plot(x, y, color=colors[i%len(colors)], linewidth=1, label='Data')
         group_ref.append(line)
 
-        for peak in peaks:
-            x_segment = range(peak[0], peak[1])
-            y_segment = group.iloc[peak[0]:peak[1], 0]
+        # All of a group's peaks are filled between the line and the x-axis as one collection
+        polygons = [peak_polygon(peak, values[peak[0]:peak[1]], per_pixel) for peak in peaks if peak[1] > peak[0]]
 
-            # Fill between line and x-axis for each segment
-            area = ax.fill_between(x_segment, y_segment, y2=0, color=colors[i%len(colors)], alpha=0.1)
-            group_ref.append(area)
+        area = PolyCollection(polygons, facecolors=colors[i%len(colors)], edgecolors='none', alpha=0.1)
+        ax.add_collection(area)
+        group_ref.append(area)
         
         group_refs.append(group_ref)
 
@@ -79,23 +333,1876 @@ def plot_processed_data(plot_data, title):
     return fig, group_refs
 
 def find_stats(data, peaks, stat):
-    out = []
-    for peak in peaks:
+    return peak_stats(data, peaks, [stat])[stat]
+
+# Every requested statistic for every peak of a group in one vectorized pass. A peak covers rows [peak_start, peak_end),
+# Duration is in frames and Area is the trapezoidal area under the plateau in percent x frames
+def peak_stats(data, peaks, stats):
+    values = data.iloc[:, 0].to_numpy(dtype=float)
+    bounds = np.array(peaks, dtype=np.int64).reshape(-1, 2)
+    starts, ends = bounds[:, 0], bounds[:, 1]
+    lengths = ends - starts
+    filled = lengths > 0
+
+    # Rows of every non-empty peak laid end to end, offsets mark where each peak begins
+    segment_lengths = lengths[filled]
+    offsets = np.concatenate(([0], np.cumsum(segment_lengths)[:-1])).astype(np.int64)
+    segments = values[np.repeat(starts[filled] - offsets, segment_lengths) + np.arange(segment_lengths.sum())]
+
+    # Empty peaks have no values to reduce, like an empty slice they give NaN
+    def per_peak(reduce):
+        out = np.full(len(bounds), np.nan)
+        if len(segments):
+            out[filled] = reduce()
+        return out
+
+    sums = np.add.reduceat(segments, offsets) if len(segments) else np.zeros(0)
+
+    def median():
+        order = np.lexsort((segments, np.repeat(np.arange(len(segment_lengths)), segment_lengths)))
+        ordered = segments[order]
+        return (ordered[offsets + (segment_lengths-1)//2] + ordered[offsets + segment_lengths//2]) / 2
+
+    def std():
+        deviations = segments - np.repeat(sums / segment_lengths, segment_lengths)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.add.reduceat(deviations**2, offsets) / (segment_lengths - 1)
+        return np.sqrt(np.where(segment_lengths > 1, variance, np.nan))
+
+    out = {}
+    for stat in stats:
         match stat:
-            case "Middle": out.append(data.iloc[(peak[0] + peak[1]) // 2, 0])
-            case "Median": out.append(data.iloc[peak[0]:peak[1], 0].median())
-            case "Mean": out.append(data.iloc[peak[0]:peak[1], 0].mean())
-            case "Maximum": out.append(data.iloc[peak[0]:peak[1], 0].max())
-    return out
+            case "Middle": out[stat] = values[(starts + ends) // 2]
+            case "Median": out[stat] = per_peak(median)
+            case "Mean": out[stat] = per_peak(lambda: sums / segment_lengths)
+            case "Maximum": out[stat] = per_peak(lambda: np.maximum.reduceat(segments, offsets))
+            case "Minimum": out[stat] = per_peak(lambda: np.minimum.reduceat(segments, offsets))
+            case "Std Dev": out[stat] = per_peak(std)
+            case "Duration": out[stat] = lengths
+            case "Area": out[stat] = per_peak(lambda: sums - (segments[offsets] + segments[offsets + segment_lengths - 1]) / 2)
+    return {stat: values.tolist() for stat, values in out.items()}
+
+# Parse a column group spec like "3,4:8" into a list of column indexes, raises ValueError with a user facing message
+def parse_column_range(input_str, column_count):
+    if input_str == "" or not input_str[0].isdigit() or not input_str[-1].isdigit():
+        raise ValueError("Column groups must start and end with digits (good 3,4:8 - bad ,2:8,10:)")
+    if not all(c in "0123456789,:" for c in input_str):
+        raise ValueError("Column groups may only contain digits, commas and colons (good 3,4:8 - bad 3;4-8)")
+
+    ranges = []
+    for range_str in input_str.split(","):
+        if range_str == "" or not range_str[0].isdigit():
+            raise ValueError("Commas must be followed by digits (good 1,2,9 - bad 2,,3)")
+
+        bounds = range_str.split(":")
+        if len(bounds) > 2:
+            raise ValueError("Ranges may only include a single colon (good 3:8 - bad 1:8:3)")
+        if bounds[-1] == "":
+            raise ValueError("Colons must be followed by digits (good 2:4 - bad 1:,10)")
+        ranges.append((min(int(bounds[0]), int(bounds[-1])), max(int(bounds[0]), int(bounds[-1]))))
+
+    # Every range is checked and the last problem found is reported. Within a range the columns are walked upwards, so one
+    # that runs out of bounds reports that over any duplicate it also holds. Ranges are checked as a whole so a wide range
+    # like 1:5000 costs the same as listing its columns once, and only the in bounds part is searched for duplicates
+    columns = []
+    seen = set()
+    error_message = None
+    for low, high in ranges:
+        in_bounds = range(low, min(high, column_count-1)+1)
+        if high >= column_count:
+            error_message = "One or more specified columns are out of bounds"
+        elif not seen.isdisjoint(in_bounds):
+            error_message = "Ranges may not inlude duplicate columns (good 2,4:6 - bad 3,2:7)"
+        new_columns = [i for i in in_bounds if i not in seen]
+        columns.extend(new_columns)
+        seen.update(new_columns)
+
+    if error_message:
+        raise ValueError(error_message)
+    return columns
+
+# Sorted column indices in the range syntax parse_column_range reads, consecutive columns become a single range
+def column_range_string(columns):
+    parts = []
+    start = prev = None
+    for i in columns:
+        if prev is not None and i == prev + 1:
+            prev = i
+            continue
+        if start is not None:
+            parts.append(str(start) if start == prev else f"{start}:{prev}")
+        start = prev = i
+    if start is not None:
+        parts.append(str(start) if start == prev else f"{start}:{prev}")
+    return ",".join(parts)
+
+# Columns whose header matches a shell style pattern such as P* or P1?, ignoring case
+def match_columns(pattern, headers):
+    pattern = pattern.strip().lower()
+    return [i for i, header in enumerate(headers) if fnmatch.fnmatchcase(str(header).lower(), pattern)]
+
+# A group given on the command line is either the range syntax or, when it has letters or wildcards, a header pattern
+def parse_column_group(spec, headers):
+    if any(c.isalpha() or c in "*?[" for c in spec):
+        columns = match_columns(spec, headers)
+        if not columns:
+            raise ValueError("No column headers match " + repr(spec))
+        return columns
+    return parse_column_range(spec, len(headers))
+
+def default_group_name(columns, input_str, headers, aggregation="mean"):
+    if len(columns) == 1:
+        return headers[columns[0]]
+    prefix = {"median": "Median", "trim": "Trim Avg", "weights": "Wtd Avg"}.get(aggregation.partition(":")[0], "Avg")
+    return prefix+" "+input_str
+
+# Coerce the given columns (all by default) to numbers, drop rows where any of them failed to parse and convert to percent
+def clean_data(df, columns=None):
+    if columns is not None:
+        df = df.iloc[:, columns]
+
+    if all(pd.api.types.is_float_dtype(dtype) for dtype in df.dtypes):
+        df_clean = df.dropna()
+    else:
+        df_clean = df.apply(pd.to_numeric, errors='coerce').dropna()
+    df_clean *= 100
+    return df_clean
+
+# --- DIC export format ---
+# Exports start with a BOM and a row of point names ("Average","C0","P0",...), followed by a row of quantity labels
+# ("e1 [1] - Lagrange") and then one row of numbers per frame. Returns the names and the quantity labels (None when the
+# second row is already data)
+def read_dic_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        second = next(reader, None)
+
+    quantities = None
+    if second and any(field.strip() for field in second) and not any(is_number(field) for field in second):
+        quantities = second
+    return columns, quantities
+
+def is_number(field):
+    try:
+        float(field)
+        return True
+    except ValueError:
+        return False
+
+# Options shared by the whole file and chunked readers. The header rows are skipped so every column parses straight to
+# numbers, and the rows keep the labels they had when the quantity row was read as row 0
+def dic_read_options(path, usecols):
+    columns, quantities = read_dic_header(path)
+    header_rows = 2 if quantities is not None else 1
+    options = {"header": None, "skiprows": header_rows, "usecols": usecols}
+    if usecols is not None:
+        columns = [columns[i] for i in sorted(usecols)]
+    return columns, quantities, header_rows - 1, options
+
+def label_dic_frame(df, columns, first_row):
+    df.columns = columns
+    df.index = pd.RangeIndex(first_row, first_row + len(df))
+    return df
+
+# The whole export as a typed numeric frame with the quantity labels in df.attrs["quantities"].
+# float32 halves the memory of a file at the cost of precision past the 7th significant digit
+def read_dic_csv(path, dtype="float64", usecols=None):
+    columns, quantities, first_row, options = dic_read_options(path, usecols)
+
+    # pyarrow parses on every core when it is installed
+    engine = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+    try:
+        df = pd.read_csv(path, dtype=dtype, engine=engine, **options)
+    except ValueError:
+        # Cells that are not numbers become NaN like clean_data would make them, the rows are dropped when cleaned
+        df = pd.read_csv(path, low_memory=False, **options).apply(pd.to_numeric, errors='coerce').astype(dtype)
+
+    df = label_dic_frame(df, columns, first_row)
+    df.attrs["quantities"] = quantities
+    return df
+
+# Chunks of rows for streaming, only the given columns are read
+def iter_dic_csv(path, usecols, chunksize):
+    columns, _, first_row, options = dic_read_options(path, usecols)
+    with pd.read_csv(path, chunksize=chunksize, **options) as reader:
+        for chunk in reader:
+            yield label_dic_frame(chunk, columns, first_row + chunk.index[0])
+
+# Only the columns used by some group need cleaning, the groups are re-indexed into that subset
+def select_columns(all_columns):
+    columns = sorted(set().union(*all_columns))
+    position = {col: i for i, col in enumerate(columns)}
+    return columns, [[position[col] for col in group] for group in all_columns]
+
+# The sidecar of a csv is a column-major .npy matrix of its parsed values plus a json file with the column names,
+# the quantity header row, the label of the first row and the size/mtime of the csv it was made from. Sidecars are
+# kept in the disk cache (DiskCache.load_sidecar)
+def sidecar_frame(matrix, meta):
+    index = pd.RangeIndex(meta["first_row"], meta["first_row"] + matrix.shape[0])
+    df = pd.DataFrame(matrix, index=index, columns=meta["columns"], copy=False)
+    df.attrs["quantities"] = meta["quantities"]
+    return df
+
+# Read a csv as a numeric frame, memory mapping its sidecar from disk when one is up to date and saving one when it isn't
+def load_csv(path, disk=None, dtype="float64"):
+    if disk:
+        df = disk.load_sidecar(path, dtype)
+        if df is not None:
+            return df, True
+
+    stat = os.stat(path)
+    df = read_dic_csv(path, dtype)
+    return (disk.save_sidecar(path, df, stat) if disk else df), False
+
+# Parsed csv files keyed on path, size and modification time so navigating between pages never re-reads or re-cleans a file
+class FileCache:
+    def __init__(self, max_files=3, disk_cache=None, dtype="float64"):
+        self.max_files = max_files
+        self.disk_cache = disk_cache
+        self.dtype = dtype
+        self.files = OrderedDict()
+        self.counters = {"read hits": 0, "read misses": 0, "clean hits": 0, "clean misses": 0, "sidecar loads": 0, "csv parses": 0}
+
+        # Safe to share between threads: one thread loads or cleans a given file while the others asking for it wait,
+        # different files are loaded at the same time
+        self.lock = threading.Lock()
+        self.path_locks = {}
+
+    def path_lock(self, path):
+        with self.lock:
+            return self.path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+    def entry(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, self.dtype)
+
+        with self.lock:
+            if key in self.files:
+                self.files.move_to_end(key)
+                return self.files[key], True
+
+            # Older versions of a file that changed on disk will never be hit again
+            for old_key in [old_key for old_key in self.files if old_key[0] == key[0]]:
+                del self.files[old_key]
+
+        raw, from_sidecar = load_csv(path, self.disk_cache, self.dtype)
+        entry = {"raw": raw, "clean": None}
+        with self.lock:
+            self.counters["sidecar loads" if from_sidecar else "csv parses"] += 1
+            self.files[key] = entry
+            while len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+        return entry, False
+
+    def read_csv(self, path):
+        with self.path_lock(path):
+            entry, hit = self.entry(path)
+        with self.lock:
+            self.counters["read hits" if hit else "read misses"] += 1
+        return entry["raw"]
+
+    def clean(self, path, columns=None):
+        with self.path_lock(path):
+            entry, _ = self.entry(path)
+            key = None if columns is None else tuple(columns)
+            hit = entry["clean"] is not None and entry["clean"][0] == key
+            if not hit:
+                entry["clean"] = (key, clean_data(entry["raw"], columns))
+            df_clean = entry["clean"][1]
+        with self.lock:
+            self.counters["clean hits" if hit else "clean misses"] += 1
+        return df_clean
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+
+    def summary(self):
+        with self.lock:
+            files = list(self.files.items())
+            lines = [f"{name}: {count}" for name, count in self.counters.items()]
+        lines.append(f"Cached files ({len(files)}/{self.max_files}):")
+        for (path, size, _, dtype), entry in reversed(files):
+            lines.append(f"  {os.path.basename(path)} - {size/1024**2:.1f} MB, {entry['raw'].shape[0]}x{entry['raw'].shape[1]} {dtype}" + (f", {entry['clean'][1].shape[1]} columns cleaned" if entry["clean"] is not None else ""))
+        return "\n".join(lines)
+
+# Weighted mean of some columns of a matrix, read in place and added left to right so a row's average never depends on
+# how many rows are averaged at once (a streamed or live file gives the same values as the whole file)
+def column_mean(matrix, columns, weights=None):
+    if weights is None:
+        total = matrix[:, columns[0]].astype(float)
+        for j in columns[1:]:
+            total += matrix[:, j]
+        return total / len(columns)
+
+    total = np.multiply(matrix[:, columns[0]], weights[0], dtype=float)
+    for j, weight in zip(columns[1:], weights[1:]):
+        total += np.multiply(matrix[:, j], weight, dtype=float)
+    return total / sum(weights)
+
+# How a group's columns are combined into one line: "mean", "median", "trim:PERCENT" (the mean once PERCENT of the
+# columns are dropped from each end of every row) or "weights:W1,W2,..." (one weight per column, in the group's order)
+AGGREGATIONS = ["mean", "median", "trim:10", "weights:"]
+# Membership matrices with at least this fraction of nonzeros, where columns are shared by two groups on average, are
+# multiplied with BLAS. Sparser ones, or groups that hardly overlap, cost less summed group by group. Measured on one
+# core, BLAS uses every core so more cores only favour the product
+DENSE_MEMBERSHIP = 0.15
+PRODUCT_ROWS = 256
+SORT_BLOCK_BYTES = 8 * 1024**2
+
+# Parse an aggregation for a group of count columns into (kind, value), raises ValueError with a user facing message
+def parse_aggregation(spec, count):
+    kind, _, value = spec.strip().lower().partition(":")
+    if kind in ("mean", "median") and not value:
+        return kind, None
+    if kind == "trim":
+        try:
+            percent = float(value)
+        except ValueError:
+            percent = -1
+        if not 0 <= percent < 50:
+            raise ValueError("Trimmed means need the percent cut from each end, from 0 up to 50 (good trim:10 - bad trim:60)")
+        return kind, percent
+    if kind == "weights":
+        try:
+            weights = tuple(float(weight) for weight in value.split(","))
+        except ValueError:
+            raise ValueError("Weights must be numbers separated by commas (good weights:1,2,1 - bad weights:1;2)") from None
+        if len(weights) != count:
+            raise ValueError(f"The group has {count} columns but {len(weights)} weights were given")
+        if not np.isfinite(weights).all() or min(weights) < 0 or sum(weights) <= 0:
+            raise ValueError("Weights may not be negative and at least one must be above zero")
+        return kind, weights
+    raise ValueError("Aggregations are mean, median, trim:PERCENT or weights:W1,W2,... (good median - bad average)")
+
+# Combines the columns of many groups at once into a rows x groups array (column major, each group's line is contiguous).
+# Mean and weighted mean groups are one product of the data with the group membership matrix (columns x groups, the
+# weights where a column is in a group). When that matrix is mostly zeros each group is summed with column_mean instead.
+# The product runs on blocks of exactly PRODUCT_ROWS rows (the last one padded), BLAS picks its kernels by the shape of
+# the operands and a fixed shape keeps every row's sum independent of how many rows are combined at once.
+# Median and trimmed mean groups with the same aggregation and number of columns are sorted together, a block of rows at a time
+class GroupAggregator:
+    def __init__(self, groups, aggregations=None):
+        parsed = [parse_aggregation(spec, len(group)) for spec, group in zip(aggregations or ["mean"]*len(groups), groups)]
+        self.groups = groups
+        self.weights = [value if kind == "weights" else None for kind, value in parsed]
+
+        self.linear = [i for i, (kind, _) in enumerate(parsed) if kind in ("mean", "weights")]
+        self.columns = sorted(set().union(*(groups[i] for i in self.linear)))
+        self.membership = None
+        cells = sum(len(groups[i]) for i in self.linear)
+        if self.linear and cells >= max(DENSE_MEMBERSHIP * len(self.linear), 2) * len(self.columns):
+            position = {col: j for j, col in enumerate(self.columns)}
+            self.membership = np.zeros((len(self.columns), len(self.linear)))
+            for k, i in enumerate(self.linear):
+                self.membership[[position[col] for col in groups[i]], k] = self.weights[i] if self.weights[i] else 1
+            self.totals = self.membership.sum(axis=0)
+            # Whole groups of neighbouring columns are sliced instead of gathered
+            contiguous = self.columns[-1] - self.columns[0] + 1 == len(self.columns)
+            self.take = slice(self.columns[0], self.columns[-1] + 1) if contiguous else np.array(self.columns, dtype=np.intp)
+
+        batches = {}
+        for i, (kind, value) in enumerate(parsed):
+            if kind in ("median", "trim"):
+                batches.setdefault((kind, value, len(groups[i])), []).append(i)
+        self.batches = [(kind, value, indexes, np.array([groups[i] for i in indexes], dtype=np.intp))
+                        for (kind, value, _), indexes in batches.items()]
+
+    def aggregate(self, matrix):
+        rows = matrix.shape[0]
+        out = np.empty((len(self.groups), rows))
+
+        if self.membership is not None:
+            block = np.zeros((PRODUCT_ROWS, len(self.columns)), order="F")
+            for start in range(0, rows, PRODUCT_ROWS):
+                end = min(start + PRODUCT_ROWS, rows)
+                block[:end - start] = matrix[start:end, self.take]
+                out[self.linear, start:end] = (block @ self.membership)[:end - start].T / self.totals[:, None]
+        else:
+            for i in self.linear:
+                out[i] = column_mean(matrix, self.groups[i], self.weights[i])
+
+        for kind, value, indexes, members in self.batches:
+            block_rows = max(1, SORT_BLOCK_BYTES // (8 * members.size))
+            count = members.shape[1]
+            cut = count // 2 if kind == "median" else int(count * value / 100)
+            for start in range(0, rows, block_rows):
+                end = min(start + block_rows, rows)
+                values = np.take(np.ascontiguousarray(matrix[start:end]), members, axis=1)
+                values.sort(axis=2)
+                if kind == "median":
+                    middle = values[:, :, cut] if count % 2 else (values[:, :, cut - 1].astype(float) + values[:, :, cut]) / 2
+                    out[indexes, start:end] = middle.T
+                    continue
+                total = values[:, :, cut].astype(float)
+                for j in range(cut + 1, count - cut):
+                    total += values[:, :, j]
+                out[indexes, start:end] = (total / (count - 2 * cut)).T
+        return out.T
+
+def average_groups(df_clean, all_columns, column_names, aggregations=None):
+    averages = GroupAggregator(all_columns, aggregations).aggregate(df_clean.to_numpy())
+    return [pd.DataFrame({name: pd.Series(averages[:, i], index=df_clean.index)}) for i, name in enumerate(column_names)]
+
+# Group averages and peak detection fed one chunk of the raw csv at a time, only the group averages are kept.
+# Chunks must only contain the columns used by the groups (iter_dic_csv usecols=stream.columns)
+class GroupStream:
+    def __init__(self, all_columns, column_names, parameters=None, aggregations=None):
+        self.columns, self.groups = select_columns(all_columns)
+        self.column_names = column_names
+        self.parameters = parameters
+        self.aggregator = GroupAggregator(self.groups, aggregations)
+        self.rows = 0
+        self.index = []
+        self.averages = [[] for _ in self.groups]
+        self.detectors = [parameter_detector(parameters) for _ in self.groups] if parameters else []
+
+    def feed(self, chunk):
+        df_clean = clean_data(chunk)
+        self.rows += df_clean.shape[0]
+        self.index.append(df_clean.index.to_numpy())
+
+        averages = self.aggregator.aggregate(df_clean.to_numpy())
+        for i, averaged in enumerate(averages.T):
+            self.averages[i].append(averaged)
+            if self.detectors:
+                self.detectors[i].feed(averaged)
+
+    # One group's averages for rows [start, end) without joining every chunk
+    def segment(self, group, start, end):
+        chunks = self.averages[group]
+        bounds = np.cumsum([0] + [len(chunk) for chunk in chunks])
+        first = np.searchsorted(bounds, start, side='right') - 1
+        last = np.searchsorted(bounds, end, side='left')
+        return np.concatenate(chunks[first:last])[start - bounds[first]:end - bounds[first]]
+
+    def processed_df(self):
+        index = pd.Index(np.concatenate(self.index)) if self.index else pd.RangeIndex(0)
+        return [pd.DataFrame({name : pd.Series(np.concatenate(averages) if averages else np.zeros(0), index=index)})
+                for name, averages in zip(self.column_names, self.averages)]
+
+    def processed_data(self):
+        return [detector.result(df) for df, detector in zip(self.processed_df(), self.detectors)]
+
+# progress is called after every chunk (with None, the total is unknown) and may raise to stop early
+def stream_file(path, all_columns, column_names, parameters=None, chunksize=STREAM_CHUNKSIZE, progress=None, aggregations=None):
+    stream = GroupStream(all_columns, column_names, parameters, aggregations)
+    for chunk in iter_dic_csv(path, stream.columns, chunksize):
+        stream.feed(chunk)
+        if progress:
+            progress(None)
+    return stream
+
+# Hash of a group's name, index and values, equal series always give the same fingerprint
+def fingerprint(data):
+    series = data.iloc[:, 0]
+    digest = hashlib.blake2b(str(series.name).encode(), digest_size=16)
+
+    index = series.index
+    if isinstance(index, pd.RangeIndex):
+        digest.update(repr((index.start, index.stop, index.step)).encode())
+    elif index.dtype.kind in "iuf":
+        digest.update(np.ascontiguousarray(index.to_numpy()).tobytes())
+    else:
+        digest.update(pd.util.hash_pandas_object(index, index=False).to_numpy().tobytes())
+
+    digest.update(np.ascontiguousarray(series.to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+# LRU of process_data results keyed by group fingerprint and parameters, bounded by the memory the results use.
+# Results are shared between callers and must not be modified
+class ResultCache:
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # The analysis service shares one cache between its worker threads, results are computed outside the lock
+        self.lock = threading.Lock()
+
+    def process(self, data, step=1, change_sense=0.0015, zero_threshold=0.005, detector="Slope", window=5):
+        key = (fingerprint(data), step, change_sense, zero_threshold, detector, window)
+        result = self.lookup(key)
+        if result is None:
+            result = process_data(data, step, change_sense, zero_threshold, detector=detector, window=window)
+            self.store(key, result)
+        return result
+
+    # The key process uses for a group and a Page 3 parameter dict
+    def parameter_key(self, data, parameters):
+        return (fingerprint(data), parameters["Step"], parameters["Slope Threshold"], parameters["Zero Threshold"],
+                parameters.get("Detector", DEFAULT_PARAMETERS["Detector"]), parameters.get("Window", DEFAULT_PARAMETERS["Window"]))
+
+    def lookup(self, key):
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                self.results.move_to_end(key)
+                return self.results[key][0]
+            self.misses += 1
+            return None
+
+    def store(self, key, result):
+        size = result.nbytes()
+        with self.lock:
+            if size <= self.max_bytes and key not in self.results:
+                self.results[key] = (result, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    self.bytes -= self.results.popitem(last=False)[1][1]
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.bytes = 0
+
+    def summary(self):
+        with self.lock:
+            return (f"result hits: {self.hits}\nresult misses: {self.misses}\n"
+                    f"Cached results ({len(self.results)}): {self.bytes/1024**2:.1f}/{self.max_bytes/1024**2:.0f} MB")
+
+DISK_CACHE_BYTES = 1024**3
+
+def default_cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "dic-peak-wizard")
+
+# Group averages, peaks and statistics kept on disk between sessions. Entries are addressed by a hash of the csv's bytes,
+# so a copy of a file on another path hits too, combined with the groups, the Page 3 parameters and the statistics:
+#   <key>.series.npz  group averages of a file and column groups
+#   <key>.peaks.json  peaks of those averages for one set of parameters
+#   <key>.stats.json  output table of those peaks for one set of statistics
+#   <key>.last.json   the parameters and statistics last used with a series
+#   <key>.sidecar.npy and .sidecar.json  the parsed values of a csv path in one dtype, see sidecar_frame
+# Reading an entry marks it as used, the least recently used entries are deleted once the directory is over max_bytes.
+# The cache is only an optimization, any entry that cannot be read or written is treated as missing
+class DiskCache:
+    def __init__(self, root=None, max_bytes=DISK_CACHE_BYTES):
+        self.root = root or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {"disk hits": 0, "disk misses": 0, "disk writes": 0, "evicted": 0}
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+    # Hash of the file's bytes, remembered for its path, size and modification time so each version is only read once
+    def content_hash(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        with self.lock:
+            known = self.read_hashes().get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024**2), b""):
+                digest.update(block)
+
+        # Read again before writing so hashes other threads stored while this file was hashed are kept,
+        # files that no longer exist are dropped so the list only grows with the files still around
+        with self.lock:
+            hashes = {known_path: entry for known_path, entry in self.read_hashes().items() if os.path.exists(known_path)}
+            hashes[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+            try:
+                self.write(os.path.join(self.root, "hashes.json"), lambda f: f.write(json.dumps(hashes).encode()))
+            except OSError:
+                pass
+        return digest.hexdigest()
+
+    def read_hashes(self):
+        try:
+            with open(os.path.join(self.root, "hashes.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def series_key(self, path, all_columns, dtype, aggregations):
+        return self.key("series", self.content_hash(path), all_columns, dtype, aggregations)
+
+    def peaks_key(self, series_key, parameters):
+        return self.key("peaks", series_key, parameters)
+
+    def stats_key(self, peaks_key, column_names, stats):
+        return self.key("stats", peaks_key, column_names, stats)
+
+    def load_series(self, key, column_names):
+        def read(path):
+            with np.load(path) as npz:
+                index, averages = npz["index"], npz["averages"]
+            if averages.shape[1] != len(column_names):
+                raise ValueError("Group count changed")
+            return [pd.DataFrame({name: pd.Series(averages[:, i], index=pd.Index(index))}) for i, name in enumerate(column_names)]
+        return self.read(key + ".series.npz", read)
+
+    def save_series(self, key, processed_df):
+        index = processed_df[0].index.to_numpy() if processed_df else np.zeros(0, dtype=np.int64)
+        averages = np.column_stack([df.iloc[:, 0].to_numpy(dtype=float) for df in processed_df]) if processed_df else np.zeros((0, 0))
+        self.save(key + ".series.npz", lambda f: np.savez(f, index=index, averages=averages))
+
+    # processed_df are the averages the peaks were found in
+    def load_peaks(self, key, processed_df):
+        def read(path):
+            with open(path) as f:
+                entry = json.load(f)
+            if len(entry["peaks"]) != len(processed_df):
+                raise ValueError("Group count changed")
+            return [ProcessedGroup(df.iloc[:, :1], [tuple(peak) for peak in peaks], open_start, entry["step"])
+                    for df, peaks, open_start in zip(processed_df, entry["peaks"], entry["open_start"])]
+        return self.read(key + ".peaks.json", read)
+
+    def save_peaks(self, key, processed_data):
+        entry = {"step": processed_data[0].step if processed_data else 1,
+                 "peaks": [group.peaks for group in processed_data], "open_start": [group.open_start for group in processed_data]}
+        self.save(key + ".peaks.json", lambda f: f.write(json.dumps(entry).encode()))
+
+    def load_stats(self, key):
+        def read(path):
+            with open(path) as f:
+                entry = json.load(f)
+            return pd.DataFrame(entry["data"], columns=entry["columns"]).astype(dict(zip(entry["columns"], entry["dtypes"])))
+        return self.read(key + ".stats.json", read)
+
+    def save_stats(self, key, output_data):
+        entry = {"columns": list(output_data.columns), "dtypes": [str(dtype) for dtype in output_data.dtypes],
+                 "data": output_data.astype(object).where(output_data.notna(), None).values.tolist()}
+        self.save(key + ".stats.json", lambda f: f.write(json.dumps(entry).encode()))
+
+    # Sidecars are addressed by the csv's path rather than its contents, hashing a large file would cost much of what the
+    # sidecar saves. Each dtype has its own, so switching Low memory on and off does not overwrite the other
+    def sidecar_key(self, path, dtype):
+        return self.key("sidecar", os.path.abspath(path), str(dtype))
+
+    def load_sidecar(self, path, dtype):
+        key = self.sidecar_key(path, dtype)
+        matrix_path = os.path.join(self.root, key + ".sidecar.npy")
+        def read(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            stat = os.stat(path)
+            if (meta["version"], meta["size"], meta["mtime_ns"], meta["dtype"]) != (SIDECAR_VERSION, stat.st_size, stat.st_mtime_ns, str(dtype)):
+                return None
+            matrix = np.load(matrix_path, mmap_mode="r")
+            if list(matrix.shape) != meta["shape"]:
+                return None
+            os.utime(matrix_path)
+            return sidecar_frame(matrix, meta)
+        return self.read(key + ".sidecar.json", read)
+
+    # df is a frame from read_dic_csv. The frame over its column-major matrix is returned even when it cannot be saved,
+    # csv files bigger than the whole cache are never saved
+    def save_sidecar(self, path, df, stat):
+        matrix = np.asfortranarray(df.to_numpy())
+        meta = {
+            "version": SIDECAR_VERSION,
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "shape": list(matrix.shape),
+            "dtype": str(matrix.dtype),
+            "columns": [str(col) for col in df.columns],
+            "quantities": df.attrs.get("quantities"),
+            "first_row": int(df.index[0]) if len(df) else 0,
+        }
+
+        # The json is saved last and is what marks the sidecar as valid
+        key = self.sidecar_key(path, matrix.dtype)
+        if matrix.nbytes <= self.max_bytes and self.save(key + ".sidecar.npy", lambda f: np.save(f, matrix)):
+            self.save(key + ".sidecar.json", lambda f: f.write(json.dumps(meta).encode()))
+        return sidecar_frame(matrix, meta)
+
+    def load_last(self, series_key):
+        def read(path):
+            with open(path) as f:
+                return json.load(f)
+        return self.read(series_key + ".last.json", read)
+
+    def save_last(self, series_key, last):
+        self.save(series_key + ".last.json", lambda f: f.write(json.dumps(last).encode()))
+
+    def read(self, name, read):
+        path = os.path.join(self.root, name)
+        try:
+            value = read(path)
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            value = None
+        with self.lock:
+            self.counters["disk hits" if value is not None else "disk misses"] += 1
+        return value
+
+    def save(self, name, write):
+        try:
+            self.write(os.path.join(self.root, name), write)
+        except OSError:
+            return False
+        with self.lock:
+            self.counters["disk writes"] += 1
+        self.evict()
+        return True
+
+    # Written next to the target and renamed over it, so a reader never sees a partly written entry
+    @staticmethod
+    def write(path, write):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name != "hashes.json" and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.counters["evicted"] += 1
+
+    def clear(self):
+        with self.lock:
+            for path in [path for _, _, path in self.entries()] + [os.path.join(self.root, "hashes.json")]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def summary(self):
+        with self.lock:
+            entries = self.entries()
+            lines = [f"{name}: {count}" for name, count in self.counters.items()]
+        lines.append(f"Disk cache ({len(entries)} entries): {sum(size for _, size, _ in entries)/1024**2:.1f}/{self.max_bytes/1024**2:.0f} MB in {self.root}")
+        return "\n".join(lines)
+
+# Peak resident memory of the whole process in bytes, None where it cannot be read
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return windows_peak_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def windows_peak_rss():
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                                                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        pass
+    return None
+
+# Wall time, rows/columns processed and peak memory of each pipeline stage. Stages run on the Tk thread and the job thread,
+# so every span records its thread. The trace is exported in Chrome's trace event format (chrome://tracing or Perfetto)
+class StageTrace:
+    def __init__(self, max_spans=1000):
+        self.spans = deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.profile_next = False
+        self.profile = None
+
+    # with trace.span(name) as info: ... info["rows"] = ...
+    # When profile_next is set the span is also run under cProfile and kept as (name, profiler)
+    @contextmanager
+    def span(self, name, **info):
+        with self.lock:
+            profiler = cProfile.Profile() if self.profile_next else None
+            self.profile_next = False
+
+        rss_before = peak_rss()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield info
+        except BaseException as e:
+            info["error"] = type(e).__name__
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+                self.profile = (name, profiler)
+
+            rss_after = peak_rss()
+            thread = threading.current_thread()
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "start": start - self.origin,
+                    "duration": time.perf_counter() - start,
+                    "thread": (thread.ident, thread.name),
+                    "peak_rss": rss_after,
+                    "peak_rss_growth": rss_after - rss_before if rss_after is not None else None,
+                    "info": info,
+                })
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+            self.profile = None
+
+    def export(self, path):
+        with self.lock:
+            spans = list(self.spans)
+
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": thread_name}}
+                  for ident, thread_name in set(span["thread"] for span in spans)]
+        for span in spans:
+            events.append({"name": span["name"], "cat": "stage", "ph": "X", "pid": pid, "tid": span["thread"][0],
+                           "ts": span["start"] * 1e6, "dur": span["duration"] * 1e6,
+                           "args": dict(span["info"], peak_rss=span["peak_rss"], peak_rss_growth=span["peak_rss_growth"])})
+            if span["peak_rss"] is not None:
+                events.append({"name": "Peak RSS (MB)", "ph": "C", "pid": pid, "ts": (span["start"] + span["duration"]) * 1e6,
+                               "args": {"MB": span["peak_rss"] / 1024**2}})
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"python": sys.version, "numpy": np.__version__, "pandas": pd.__version__}}, f, indent=1)
+
+    def summary(self):
+        with self.lock:
+            spans = list(self.spans)
+
+        lines = [f"Stages ({len(spans)}):"]
+        for span in spans[-15:]:
+            info = span["info"]
+            shape = f"{info.get('rows', '-')}x{info.get('columns', '-')}"
+            memory = f"{span['peak_rss']/1024**2:.0f} MB peak" if span["peak_rss"] is not None else "peak unknown"
+            lines.append(f"  {span['name']:<24} {span['duration']*1000:>9.1f} ms  {shape:>13}  {memory}" + (f"  ({info['error']})" if "error" in info else ""))
+
+        if self.profile_next:
+            lines.append("Profiling the next stage")
+        elif self.profile:
+            lines.append(f"Profile captured: {self.profile[0]}")
+        return "\n".join(lines)
+
+# Follows a csv the DIC software is still writing, each poll only parses the complete lines appended since the last one
+class LiveFile:
+    def __init__(self, path, all_columns, column_names, parameters, aggregations=None, chunksize=STREAM_CHUNKSIZE):
+        self.path = path
+        self.all_columns = all_columns
+        self.column_names = column_names
+        self.parameters = parameters
+        self.aggregations = aggregations
+        self.chunksize = chunksize
+        self.restart()
+
+    def restart(self):
+        self.stream = GroupStream(self.all_columns, self.column_names, self.parameters, self.aggregations)
+        self.offset = 0
+        self.lines = 0
+
+    # Returns None when nothing new was written, otherwise (restarted, groups) where groups holds the
+    # (index, averages, new peaks) of every group for the new rows. restarted means the file was replaced and read from the start.
+    # The new lines are read and fed chunksize lines at a time, so catching up with a large file only holds one chunk.
+    # progress is called after every chunk and may raise to stop early, the chunks fed so far are kept
+    def poll(self, progress=None):
+        restarted = os.path.getsize(self.path) < self.offset
+        if restarted:
+            self.restart()
+
+        peak_counts = [len(detector.peaks) for detector in self.stream.detectors]
+        chunks = len(self.stream.index)
+        fed = False
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+
+            # The groups refer to columns by index so the header line is only skipped
+            if self.offset == 0:
+                header = f.readline()
+                if not header.endswith(b"\n"):
+                    return (True, self.new_rows(peak_counts, chunks)) if restarted else None
+                self.offset = len(header)
+
+            while True:
+                lines = list(itertools.islice(f, self.chunksize))
+                complete = len(lines) == self.chunksize
+
+                # A partly written last line is left for the next poll
+                if lines and not lines[-1].endswith(b"\n"):
+                    lines.pop()
+                    complete = False
+
+                data = b"".join(lines)
+                if data.strip():
+                    chunk = pd.read_csv(io.BytesIO(data), header=None, usecols=self.stream.columns)
+                    chunk.index = pd.RangeIndex(self.lines, self.lines + len(chunk))
+                    self.lines += len(chunk)
+                    self.stream.feed(chunk)
+                    fed = True
+                self.offset += len(data)
+
+                if not complete:
+                    break
+                if progress:
+                    progress(None)
+
+        if not (fed or restarted):
+            return None
+        return restarted, self.new_rows(peak_counts, chunks)
+
+    def new_rows(self, peak_counts, chunks):
+        index = np.concatenate(self.stream.index[chunks:]) if len(self.stream.index) > chunks else np.zeros(0, dtype=np.int64)
+        return [(index,
+                 np.concatenate(averages[chunks:]) if len(averages) > chunks else np.zeros(0),
+                 detector.peaks[count:])
+                for averages, detector, count in zip(self.stream.averages, self.stream.detectors, peak_counts)]
+
+# progress is called with the fraction of groups done and may raise to stop early
+def process_groups(processed_df, parameters, cache=None, progress=None, pool=None):
+    if pool is not None:
+        return pool.process(processed_df, parameters, cache, progress)
+
+    process = cache.process if cache else process_data
+    processed_data = []
+    for df in processed_df:
+        processed_data.append(process(df,
+            change_sense=parameters["Slope Threshold"],
+            zero_threshold=parameters["Zero Threshold"],
+            step=parameters["Step"],
+            detector=parameters.get("Detector", DEFAULT_PARAMETERS["Detector"]),
+            window=parameters.get("Window", DEFAULT_PARAMETERS["Window"])))
+        if progress:
+            progress(len(processed_data) / len(processed_df))
+    return processed_data
+
+# --- Parallel group processing ---
+# Below this many cells of group columns starting worker processes costs more than averaging on one core
+GROUP_POOL_MIN_CELLS = 10_000_000
+
+def use_group_pool(rows, all_columns):
+    return len(all_columns) > 1 and (os.cpu_count() or 1) > 1 and rows * sum(len(group) for group in all_columns) >= GROUP_POOL_MIN_CELLS
+
+# A numpy array in a shared memory block, (name, shape, dtype) is all another process needs to map it
+def create_shared(shape, dtype):
+    from multiprocessing.shared_memory import SharedMemory
+    shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf, order="F")
+
+def attach_shared(name, shape, dtype):
+    from multiprocessing.shared_memory import SharedMemory
+    # Pool workers share the creating process's resource tracker, which unlinks the block if the app dies without closing it
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf, order="F")
+
+def close_shared(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+# Every group pool worker maps the cleaned matrix and the group averages once when it starts
+_group_blocks = []
+_group_matrix = None
+_group_averages = None
+
+def init_group_worker(matrix_spec, averages_spec):
+    global _group_blocks, _group_matrix, _group_averages
+    matrix_shm, _group_matrix = attach_shared(*matrix_spec)
+    averages_shm, _group_averages = attach_shared(*averages_spec)
+    _group_blocks = [matrix_shm, averages_shm]
+
+def average_groups_task(start, end, groups, aggregations):
+    _group_averages[start:end] = GroupAggregator(groups, aggregations).aggregate(_group_matrix[start:end])
+    return end - start
+
+def detect_group_task(i, parameters):
+    detector = parameter_detector(parameters)
+    detector.feed(_group_averages[:, i])
+    return i, detector.peaks, detector.open_start
+
+# Group averages and peak detection for many groups on worker processes. The cleaned matrix is copied once into shared
+# memory (column major, so each column is contiguous) and workers write the group averages (GroupAggregator) to a second shared block.
+# Detection only sends a group index and the parameters to a worker and gets the peak intervals back.
+# all_columns index the columns of df_clean (select_columns)
+class GroupPool:
+    def __init__(self, df_clean, all_columns, workers=None):
+        import weakref
+
+        self.index = df_clean.index
+        self.all_columns = all_columns
+        self.frames = None
+        matrix = df_clean.to_numpy()
+
+        matrix_shm, shared_matrix = create_shared(matrix.shape, matrix.dtype)
+        shared_matrix[:] = matrix
+        averages_shm, self.averages = create_shared((len(matrix), len(all_columns)), np.float64)
+        self.blocks = [matrix_shm, averages_shm]
+
+        self.workers = min(workers or os.cpu_count() or 1, len(all_columns))
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_group_worker,
+                                            initargs=((matrix_shm.name, matrix.shape, matrix.dtype), (averages_shm.name, self.averages.shape, np.float64)))
+        # The blocks are freed even if the pool is dropped without close, e.g. when its job was cancelled
+        self.finalizer = weakref.finalize(self, GroupPool.release, self.executor, self.blocks)
+
+    @staticmethod
+    def release(executor, blocks):
+        executor.shutdown(wait=True, cancel_futures=True)
+        close_shared(blocks)
+
+    def close(self):
+        self.averages = None
+        self.finalizer()
+
+    # The layout average_groups returns. Each task combines every group over a slice of the rows, a few slices per worker
+    # so progress moves. Rows are combined independently, so the values match average_groups exactly
+    def average(self, column_names, aggregations=None, progress=None):
+        rows = len(self.index)
+        bounds = np.linspace(0, rows, min(rows, 4 * self.workers) + 1).astype(int)
+        futures = [self.executor.submit(average_groups_task, start, end, self.all_columns, aggregations)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            if progress:
+                progress(done / len(futures))
+        self.frames = [pd.DataFrame({name: pd.Series(self.averages[:, i].copy(), index=self.index)}) for i, name in enumerate(column_names)]
+        return self.frames
+
+    # processed_df must be what average returned (self.frames). Groups found in cache are not sent to the workers
+    def process(self, processed_df, parameters, cache=None, progress=None):
+        keys = [cache.parameter_key(df, parameters) for df in processed_df] if cache else [None] * len(processed_df)
+        processed_data = [cache.lookup(key) if cache else None for key in keys]
+
+        futures = [self.executor.submit(detect_group_task, i, dict(parameters)) for i, result in enumerate(processed_data) if result is None]
+        for done, future in enumerate(as_completed(futures), start=1):
+            i, peaks, open_start = future.result()
+            processed_data[i] = ProcessedGroup(processed_df[i].iloc[:, :1], peaks, open_start, parameters["Step"])
+            if cache:
+                cache.store(keys[i], processed_data[i])
+            if progress:
+                progress(done / len(futures))
+        return processed_data
+
+# --- Parameter sweep ---
+SWEEP_STEPS = [1, 2, 3, 5, 8, 13, 21]
+SWEEP_KEYS = ["Slope Threshold", "Zero Threshold", "Step"]
+
+def count_peaks(values, step, change_sense, zero_threshold, detector="Slope", window=5):
+    detector = DETECTORS[detector](step, change_sense, zero_threshold, window)
+    detector.feed(values)
+    return len(detector.peaks)
+
+# Every sweep worker gets the group series and the detector once instead of with every task
+_sweep_values = None
+_sweep_detector = ("Slope", 5)
+
+def init_sweep_worker(values, detector="Slope", window=5):
+    global _sweep_values, _sweep_detector
+    _sweep_values = values
+    _sweep_detector = (detector, window)
+
+def sweep_counts(settings):
+    return [tuple(count_peaks(values, step, change_sense, zero_threshold, *_sweep_detector) for values in _sweep_values)
+            for change_sense, zero_threshold, step in settings]
+
+# Coarse grid of candidate settings, the zero thresholds come from the spread of the data
+def sweep_grid(group_values):
+    values = np.concatenate(group_values)
+    zeros = np.quantile(values, [0.05, 0.1, 0.2, 0.3, 0.4]).clip(min=0)
+    return [
+        np.round(np.geomspace(0.01, 2, 12), 4).tolist(),
+        np.unique(np.round(np.concatenate(([0, DEFAULT_PARAMETERS["Zero Threshold"]], zeros)), 4)).tolist(),
+        SWEEP_STEPS,
+    ]
+
+# Finer grid spanning the neighbours of the best coarse setting
+def refine_grid(grid, index):
+    refined = []
+    for axis, (values, i) in enumerate(zip(grid, index)):
+        low, high = values[max(i-1, 0)], values[min(i+1, len(values)-1)]
+        if axis == 2:
+            refined.append(list(range(low, high+1)))
+        else:
+            refined.append(np.unique(np.round(np.linspace(low, high, 5), 4)).tolist())
+    return refined
+
+# Score every setting of a grid: how many groups agree on the peak count, how many other agreeing settings found
+# that same count (support) and how many neighbouring settings give the same counts (stability).
+# Support is the share of agreeing settings with the count at each Step, averaged over the Steps. Coarse Steps merge
+# plateaus and agree on a low count at far more settings, counted together they would outvote the finer Steps
+def rank_grid(grid, counts):
+    agreeing = {}
+    for index, c in counts.items():
+        if len(set(c)) == 1 and c[0] > 0:
+            agreeing.setdefault(index[2], []).append(c[0])
+    support = {}
+    for step_counts in agreeing.values():
+        for peaks in set(step_counts):
+            support[peaks] = support.get(peaks, 0.0) + step_counts.count(peaks) / len(step_counts) / len(agreeing)
+
+    ranked = []
+    for index, group_counts in counts.items():
+        peaks = max(set(group_counts), key=group_counts.count)
+        neighbours = [counts[n] for n in
+                      (index[:axis] + (index[axis]+offset,) + index[axis+1:] for axis in range(3) for offset in (-1, 1))
+                      if n in counts]
+
+        ranked.append({
+            "parameters": {key: grid[axis][index[axis]] for axis, key in enumerate(SWEEP_KEYS)},
+            "index": index,
+            "peaks": peaks,
+            "counts": group_counts,
+            "agreement": group_counts.count(peaks) / len(group_counts),
+            "stability": sum(n == group_counts for n in neighbours) / len(neighbours) if neighbours else 0.0,
+            "support": support.get(peaks, 0.0),
+        })
+
+    ranked.sort(key=lambda r: (r["agreement"], r["peaks"] > 0, r["support"], r["stability"], -r["parameters"]["Step"]), reverse=True)
+    return ranked
+
+def evaluate_grid(executor, grid, progress=None, batch_size=16):
+    indexes = [(i, j, k) for i in range(len(grid[0])) for j in range(len(grid[1])) for k in range(len(grid[2]))]
+    batches = [indexes[b:b+batch_size] for b in range(0, len(indexes), batch_size)]
+
+    futures = {executor.submit(sweep_counts, [(grid[0][i], grid[1][j], grid[2][k]) for i, j, k in batch]): batch for batch in batches}
+    counts = {}
+    for done, future in enumerate(as_completed(futures), start=1):
+        counts.update(zip(futures[future], future.result()))
+        if progress:
+            progress(done / len(batches))
+    return counts
+
+# Evaluate a grid of Slope Threshold x Zero Threshold x Step on worker processes, then a finer grid around the best setting.
+# Returns every evaluated setting, best first
+def sweep_parameters(processed_df, workers=None, refine=True, progress=None, detector="Slope", window=5):
+    group_values = [df.iloc[:, 0].to_numpy(dtype=float) for df in processed_df]
+    grid = sweep_grid(group_values)
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_worker, initargs=(group_values, detector, window))
+    try:
+        report = (lambda done: progress(done * (0.5 if refine else 1))) if progress else None
+        ranked = rank_grid(grid, evaluate_grid(executor, grid, report))
+
+        # Look for a more stable setting with the same result close to the best one
+        if refine:
+            best = ranked[0]
+            fine_grid = refine_grid(grid, best["index"])
+            report = (lambda done: progress(0.5 + done*0.5)) if progress else None
+            fine = [r for r in rank_grid(fine_grid, evaluate_grid(executor, fine_grid, report))
+                    if r["counts"] == best["counts"] and r["stability"] > best["stability"]]
+            fine.sort(key=lambda r: (r["stability"], -r["parameters"]["Step"]), reverse=True)
+            ranked = fine[:1] + ranked
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    return ranked
+
+# One column per (stat, group) pair, rows are peaks
+def build_output(processed_data, column_names, stats, progress=None):
+    group_stats = []
+    for group in processed_data:
+        group_stats.append(peak_stats(group[0], group[1], stats))
+        if progress:
+            progress(len(group_stats) / len(processed_data))
+
+    return pd.DataFrame({column_names[j] + " " + stat : group_stats[j][stat]
+                         for stat in stats for j in range(len(processed_data))})
+
+# --- Export ---
+# Tab separated text for pasting into a spreadsheet, built in one join so it stays linear in the size of the table
+def table_tsv(df):
+    lines = ["\t".join(map(str, df.columns))]
+    lines += ["\t".join(map(str, row)) for row in df.itertuples(index=False, name=None)]
+    return "\n".join(lines)
+
+# Every group's average for every frame, the frames are the csv row labels
+def frames_table(processed_data, column_names):
+    table = {"Frame": processed_data[0][0].index.to_numpy() if processed_data else []}
+    for name, group in zip(column_names, processed_data):
+        table[name] = group[0].iloc[:, 0].to_numpy()
+    return pd.DataFrame(table)
+
+# One row per detected peak, End Frame is the last frame inside the peak
+def peaks_table(processed_data, column_names):
+    rows = []
+    for name, (data, peaks) in zip(column_names, processed_data):
+        index = data.index
+        for number, (start, end) in enumerate(peaks, start=1):
+            rows.append((name, number, index[start], index[max(end - 1, start)], end - start))
+    return pd.DataFrame(rows, columns=["Group", "Peak", "Start Frame", "End Frame", "Frames"])
+
+# The tables written by write_tables, the summary statistics first
+def export_tables(output_data, processed_data=None, column_names=None):
+    tables = {"Summary": output_data}
+    if processed_data is not None:
+        tables["Frames"] = frames_table(processed_data, column_names)
+        tables["Peaks"] = peaks_table(processed_data, column_names)
+    return tables
+
+# Writes the tables in the format given by the extension of path (.csv, .parquet or .xlsx) and returns the files written.
+# Excel gets one sheet per table, the other formats one file per table named after path ("results_frames.csv").
+# Rows are written in blocks so progress can be reported and the job cancelled between them
+def write_tables(path, tables, progress=None):
+    root, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext not in (".csv", ".parquet", ".xlsx"):
+        raise ValueError("Unsupported file type " + repr(ext) + ", save as .csv, .parquet or .xlsx")
+
+    total = sum(len(df) for df in tables.values()) or 1
+    written = 0
+    def advance(rows):
+        nonlocal written
+        written += rows
+        if progress:
+            progress(written / total)
+
+    if ext == ".xlsx":
+        write_excel(path, tables, advance)
+        return [path]
+
+    paths = []
+    for i, (name, df) in enumerate(tables.items()):
+        table_path = path if i == 0 else root + "_" + name.lower() + ext
+        (write_csv if ext == ".csv" else write_parquet)(table_path, df, advance)
+        paths.append(table_path)
+    return paths
+
+def write_csv(path, df, advance):
+    with open(path, "w", newline="") as f:
+        df.iloc[:0].to_csv(f, index=False)
+        for start in range(0, len(df), EXPORT_CHUNKSIZE):
+            chunk = df.iloc[start:start + EXPORT_CHUNKSIZE]
+            chunk.to_csv(f, index=False, header=False)
+            advance(len(chunk))
+
+def write_parquet(path, df, advance):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Saving .parquet files needs the pyarrow package (pip install pyarrow)")
+
+    schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for start in range(0, len(df), EXPORT_CHUNKSIZE):
+            chunk = df.iloc[start:start + EXPORT_CHUNKSIZE]
+            writer.write_table(pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            advance(len(chunk))
+
+# Write-only workbooks stream rows to disk. A table longer than a sheet continues on "Frames 2", "Frames 3", ...
+def write_excel(path, tables, advance):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Saving .xlsx files needs the openpyxl package (pip install openpyxl)")
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet_rows = EXCEL_MAX_ROWS - 1
+    for name, df in tables.items():
+        for part, start in enumerate(range(0, max(len(df), 1), sheet_rows)):
+            sheet = workbook.create_sheet(name if part == 0 else f"{name} {part + 1}")
+            sheet.append([str(col) for col in df.columns])
+
+            for block in range(start, min(start + sheet_rows, len(df)), EXPORT_CHUNKSIZE):
+                chunk = df.iloc[block:min(block + EXPORT_CHUNKSIZE, start + sheet_rows)]
+                # Empty cells instead of NaN, which Excel cannot store
+                for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                    sheet.append(row)
+                advance(len(chunk))
+    workbook.save(path)
+
+# Groups given as "columns@aggregation=name" (the aggregation and name are optional) split into the column specs, names and aggregations
+def split_group_args(groups):
+    group_specs = []
+    group_names = []
+    aggregations = []
+    for group in groups:
+        spec, _, name = group.partition("=")
+        spec, _, aggregation = spec.partition("@")
+        group_specs.append(spec)
+        group_names.append(name)
+        aggregations.append(aggregation or "mean")
+    return group_specs, group_names, aggregations
+
+def resolve_groups(headers, group_specs, group_names, aggregations=None):
+    all_columns = [parse_column_group(spec, headers) for spec in group_specs]
+    column_names = [name if name else default_group_name(columns, spec, headers, aggregation)
+                    for columns, spec, name, aggregation in zip(all_columns, group_specs, group_names, aggregations or ["mean"]*len(group_specs))]
+    return all_columns, column_names
+
+# Run the whole wizard pipeline on one file, returns the output table and the number of rows analyzed
+def analyze_file(path, group_specs, group_names, parameters, stats, chunksize=None, dtype="float64", aggregations=None):
+    headers, _ = read_dic_header(path)
+    all_columns, column_names = resolve_groups(headers, group_specs, group_names, aggregations)
+
+    processed_data, rows = process_file(path, all_columns, column_names, parameters, chunksize, dtype, aggregations)
+    check_peak_counts(processed_data, column_names)
+    return build_output(processed_data, column_names, stats), rows
+
+# Group averages and peaks of one file without keeping the file, returns them with the number of rows analyzed
+def process_file(path, all_columns, column_names, parameters, chunksize=None, dtype="float64", aggregations=None):
+    if chunksize:
+        stream = stream_file(path, all_columns, column_names, parameters, chunksize, aggregations=aggregations)
+        return stream.processed_data(), stream.rows
+
+    columns, groups = select_columns(all_columns)
+    df_clean = clean_data(read_dic_csv(path, dtype, usecols=columns))
+    return process_groups(average_groups(df_clean, groups, column_names, aggregations), parameters), df_clean.shape[0]
+
+def check_peak_counts(processed_data, column_names):
+    peak_counts = [len(group[1]) for group in processed_data]
+    if len(set(peak_counts)) > 1:
+        raise ValueError("Groups detected different numbers of peaks (" + ", ".join(f"{name}: {count}" for name, count in zip(column_names, peak_counts)) + ")")
+
+# --- Specimen comparison ---
+SPECIMEN_PIXELS = 1200
+
+# One specimen of a comparison, analyzed with the groups and settings chosen in the wizard. Only the statistics table and
+# a decimated copy of each group's line are returned, so comparing many large files never holds their frames
+def analyze_specimen(path, all_columns, column_names, parameters, stats, dtype="float64", aggregations=None):
+    headers, _ = read_dic_header(path)
+    columns, _ = select_columns(all_columns)
+    if columns[-1] >= len(headers):
+        raise ValueError(f"Has {len(headers)} columns, the groups use columns up to {columns[-1]}")
+
+    chunksize = STREAM_CHUNKSIZE if os.path.getsize(path) > STREAM_THRESHOLD else None
+    processed_data, rows = process_file(path, all_columns, column_names, parameters, chunksize, dtype, aggregations)
+    check_peak_counts(processed_data, column_names)
+
+    return {
+        "name": os.path.splitext(os.path.basename(path))[0],
+        "rows": rows,
+        "peaks": len(processed_data[0][1]) if processed_data else 0,
+        "table": build_output(processed_data, column_names, stats),
+        "lines": [decimate(data.index.to_numpy(), data.iloc[:, 0].to_numpy(dtype=float), SPECIMEN_PIXELS) for data, _ in processed_data],
+    }
+
+# Analyze every file on worker processes. Returns (results, failures) in the order of paths, failures are (path, message).
+# progress is called with the fraction of files done and may raise to stop early
+def analyze_specimens(paths, all_columns, column_names, parameters, stats, dtype="float64", workers=None, progress=None, aggregations=None):
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(analyze_specimen, path, all_columns, column_names, parameters, stats, dtype, aggregations): path for path in paths}
+        done = {}
+        for count, future in enumerate(as_completed(futures), start=1):
+            try:
+                done[futures[future]] = future.result()
+            except Exception as e:
+                done[futures[future]] = e
+            if progress:
+                progress(count / len(paths))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    results = [done[path] for path in paths if not isinstance(done[path], Exception)]
+    failures = [(path, str(done[path])) for path in paths if isinstance(done[path], Exception)]
+    return results, failures
+
+# Peak k of every specimen compared with peak k of the others: the mean and sample standard deviation of every statistic
+# across the specimens that have that peak
+def compare_specimens(tables):
+    stacked = pd.concat(tables, keys=range(len(tables)))
+    grouped = stacked.groupby(level=1)
+    mean, spread = grouped.mean(), grouped.std()
+
+    out = pd.DataFrame({"Peak": mean.index + 1, "Specimens": grouped.size().to_numpy()}, index=mean.index)
+    for col in stacked.columns:
+        out[col + " Mean"] = mean[col]
+        out[col + " Std Dev"] = spread[col]
+    return out.reset_index(drop=True)
+
+# One row per specimen with its file, rows analyzed and peaks found
+def specimens_table(results):
+    return pd.DataFrame({"Specimen": [result["name"] for result in results],
+                         "Rows": [result["rows"] for result in results],
+                         "Peaks": [result["peaks"] for result in results]})
+
+# Every specimen's groups on one graph, a color per specimen and a line style per group
+def plot_specimens(results, column_names, title):
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+
+    fig = Figure()
+    ax = fig.subplots()
+    styles = ['-', '--', ':', '-.']
+
+    for i, result in enumerate(results):
+        for j, (x, y) in enumerate(result["lines"]):
+            ax.plot(x, y, color=f"C{i%10}", linestyle=styles[j%len(styles)], linewidth=1,
+                    label=result["name"] if j == 0 else None)
+
+    ax.set_ylabel("Percent Elongation")
+    ax.set_title(title)
+
+    # Specimens are told apart by color, groups by line style
+    specimen_legend = ax.legend(loc="upper left", fontsize="small")
+    if len(column_names) > 1:
+        ax.add_artist(specimen_legend)
+        ax.legend([Line2D([], [], color="gray", linestyle=styles[j%len(styles)]) for j in range(len(column_names))],
+                  column_names, loc="upper right", fontsize="small")
+    return fig
+
+# --- Analysis service ---
+SERVICE_PORT = 8765
+
+# Each run of the service makes a new token, clients on this computer read it from a file only the user can read
+def service_token_path(port):
+    return os.path.join(default_cache_dir(), f"service-{port}.token")
+
+def write_service_token(port):
+    import secrets
+    token = secrets.token_urlsafe(32)
+    path = service_token_path(port)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+def read_service_token(port):
+    try:
+        with open(service_token_path(port)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+# Parameters sent from outside the wizard checked against the same limits as Page 3 and batch mode, missing ones use
+# the defaults. Raises ValueError with a message for the client
+def check_parameters(parameters):
+    if not isinstance(parameters, dict):
+        raise ValueError("\"parameters\" must be an object")
+    unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown parameters " + ", ".join(sorted(map(str, unknown))) + ", choose from " + ", ".join(DEFAULT_PARAMETERS))
+    parameters = dict(DEFAULT_PARAMETERS, **parameters)
+
+    for key in ["Slope Threshold", "Zero Threshold"]:
+        value = parameters[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value) or value < 0:
+            raise ValueError(f"{key} must be a number of at least 0")
+        parameters[key] = float(value)
+    for key, high in [("Step", 50), ("Window", 500)]:
+        value = parameters[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 1 <= value <= high or value != int(value):
+            raise ValueError(f"{key} must be a whole number from 1 to {high}")
+        parameters[key] = int(value)
+    if parameters["Detector"] not in DETECTORS:
+        raise ValueError("Unknown detector " + repr(parameters["Detector"]) + ", choose from " + ", ".join(DETECTORS))
+    return parameters
+
+# Arrays travel as base64 of their little endian bytes, which is far smaller and faster to parse than json numbers
+def encode_array(values, dtype="<f8"):
+    import base64
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+def decode_array(text, dtype="<f8"):
+    import base64
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+# Runs analyses for local clients (the wizard, LIMS scripts) on a pool of worker threads. Parsed files and peak results
+# are kept in caches shared by every request, so repeating an analysis only re-reads what changed on disk.
+# Plots are only written inside plot_dir, without one requests for a plot are refused
+class AnalysisService:
+    def __init__(self, workers=None, dtype="float64", max_files=8, plot_dir=None, disk_cache=None):
+        self.plot_dir = os.path.realpath(plot_dir) if plot_dir else None
+        self.file_cache = FileCache(max_files=max_files, disk_cache=disk_cache, dtype=dtype)
+        self.result_cache = ResultCache()
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.started = time.time()
+        self.requests = 0
+
+    # request: {"path", "groups": ["3,4:8=Center", "P*@median"], "parameters": {...}, "stats": [...], "values": bool, "plot": png path}.
+    # Missing parameters use the wizard's defaults, "stats" defaults to every statistic and an empty list skips the table
+    def analyze(self, request):
+        start = time.perf_counter()
+        self.requests += 1
+
+        if not isinstance(request, dict) or not request.get("path") or not request.get("groups"):
+            raise ValueError("Requests need a \"path\" and a list of \"groups\"")
+        path = request["path"]
+        if not isinstance(path, str):
+            raise ValueError("\"path\" must be a file path")
+        groups = request["groups"]
+        if not isinstance(groups, list) or not all(isinstance(group, str) for group in groups):
+            raise ValueError("\"groups\" must be a list of strings like \"3,4:8=Center\"")
+        stats = request.get("stats", OPTIONS_NAMES)
+        if not isinstance(stats, list) or not all(isinstance(stat, str) for stat in stats):
+            raise ValueError("\"stats\" must be a list of statistic names")
+        unknown = set(stats) - set(OPTIONS_NAMES)
+        if unknown:
+            raise ValueError("Unknown statistics " + ", ".join(sorted(unknown)) + ", choose from " + ", ".join(OPTIONS_NAMES))
+        stats = [stat for stat in OPTIONS_NAMES if stat in stats]
+        parameters = check_parameters(request.get("parameters", {}))
+        plot_path = self.plot_path(request["plot"]) if request.get("plot") else None
+
+        headers, _ = read_dic_header(path)
+        group_specs, group_names, aggregations = split_group_args(groups)
+        all_columns, column_names = resolve_groups(headers, group_specs, group_names, aggregations)
+        columns, groups = select_columns(all_columns)
+
+        # Files too big to keep in memory are streamed on every request like the wizard does
+        if os.path.getsize(path) > STREAM_THRESHOLD:
+            processed_df = stream_file(path, all_columns, column_names, aggregations=aggregations).processed_df()
+        else:
+            processed_df = average_groups(self.file_cache.clean(path, columns), groups, column_names, aggregations)
+
+        response = {"groups": column_names, "rows": len(processed_df[0]) if processed_df else 0}
+        if request.get("values"):
+            response["index"] = encode_array(processed_df[0].index if processed_df else [], "<i8")
+            response["values"] = [encode_array(df.iloc[:, 0]) for df in processed_df]
+
+        if request.get("detect", True):
+            processed_data = process_groups(processed_df, parameters, self.result_cache)
+            response["parameters"] = parameters
+            response["peaks"] = [group.peaks for group in processed_data]
+            response["open_start"] = [group.open_start for group in processed_data]
+
+            # The table needs every group to find the same peaks, the counts tell a client why it is missing
+            peak_counts = [len(group.peaks) for group in processed_data]
+            if stats and len(set(peak_counts)) == 1:
+                output_data = build_output(processed_data, column_names, stats)
+                response["table"] = {"columns": list(output_data.columns),
+                                     "data": output_data.astype(object).where(output_data.notna(), None).values.tolist()}
+
+            if plot_path:
+                fig, _ = plot_processed_data(processed_data, os.path.splitext(os.path.basename(path))[0])
+                fig.savefig(plot_path)
+                response["plot"] = plot_path
+
+        response["seconds"] = time.perf_counter() - start
+        return response
+
+    # A plot path from a request resolved inside plot_dir (relative paths are taken from there), raises ValueError outside it
+    def plot_path(self, path):
+        if not self.plot_dir:
+            raise ValueError("Plots are turned off, start the service with --plot-dir to allow them")
+        if not isinstance(path, str):
+            raise ValueError("\"plot\" must be a file name")
+        resolved = os.path.realpath(os.path.join(self.plot_dir, path))
+        if os.path.commonpath([resolved, self.plot_dir]) != self.plot_dir or resolved == self.plot_dir:
+            raise ValueError("Plots can only be written inside " + self.plot_dir)
+        return resolved
+
+    def status(self):
+        return {"uptime": time.time() - self.started, "requests": self.requests, "workers": self.workers,
+                "files": self.file_cache.summary(), "results": self.result_cache.summary()}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Request handler bound to a service, GET /status and POST /analyze with a json body. Analyses run on the service's
+# worker pool so at most workers of them run at once however many clients are connected.
+# Web pages open in a browser can reach the loopback address too, so every request needs the run's token and requests
+# a browser would send (an Origin header, another Host, a body that is not application/json) are refused
+def service_handler(service, token):
+    import hmac
+    from http.server import BaseHTTPRequestHandler
+
+    class ServiceHandler(BaseHTTPRequestHandler):
+        # Returns whether the request may go on, otherwise it has been answered
+        def allowed(self, body=False):
+            hosts = {f"127.0.0.1:{self.server.server_port}", f"localhost:{self.server.server_port}"}
+            if self.headers.get("Host") not in hosts or self.headers.get("Origin") is not None:
+                self.reply(403, {"error": "Requests from web pages are not accepted"})
+            elif not hmac.compare_digest(self.headers.get("Authorization", ""), "Bearer " + token):
+                self.reply(401, {"error": "Missing or wrong service token"})
+            elif body and self.headers.get_content_type() != "application/json":
+                self.reply(415, {"error": "The request body must be application/json"})
+            else:
+                return True
+            return False
+
+        def do_GET(self):
+            if not self.allowed():
+                return
+            if self.path == "/status":
+                self.reply(200, service.status())
+            else:
+                self.reply(404, {"error": "Unknown path " + self.path})
+
+        def do_POST(self):
+            if not self.allowed(body=True):
+                return
+            if self.path != "/analyze":
+                self.reply(404, {"error": "Unknown path " + self.path})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                response = service.executor.submit(service.analyze, request).result()
+            except (ValueError, TypeError, OSError) as e:
+                self.reply(400, {"error": str(e)})
+            except Exception as e:
+                self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+            else:
+                self.reply(200, response)
+
+        def reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} - {format % args}", file=sys.stderr)
+
+    return ServiceHandler
+
+# Client for a running service. Errors the service reports are raised as ValueError, OSError means it could not be reached.
+# Without a token the one the service on the url's port wrote for this user is used
+class ServiceClient:
+    def __init__(self, url=f"http://127.0.0.1:{SERVICE_PORT}", timeout=600, token=None):
+        import urllib.parse
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.token = token
+        self.port = urllib.parse.urlsplit(self.url).port or 80
+
+    def analyze(self, request):
+        return self.call("/analyze", request)
+
+    def status(self):
+        return self.call("/status")
+
+    def call(self, path, request=None):
+        import urllib.request
+        import urllib.error
+
+        data = None if request is None else json.dumps(request).encode()
+        # Read on every call so a restarted service's new token is picked up
+        token = self.token or read_service_token(self.port) or ""
+        http_request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json", "Authorization": "Bearer " + token})
+        # The service is local, a proxy from the environment must not be used
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        try:
+            with opener.open(http_request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read())["error"]
+            except (ValueError, KeyError):
+                message = str(e)
+            raise ValueError(message) from None
+
+# The group averages of a response made with "values", in the layout average_groups returns
+def service_frames(response):
+    index = pd.Index(decode_array(response["index"], "<i8"))
+    return [pd.DataFrame({name: pd.Series(decode_array(values), index=index)})
+            for name, values in zip(response["groups"], response["values"])]
+
+# The peaks of a response as process_data results for the given group averages
+def service_groups(response, processed_df):
+    step = response["parameters"]["Step"]
+    return [ProcessedGroup(df, [tuple(peak) for peak in peaks], open_start, step)
+            for df, peaks, open_start in zip(processed_df, response["peaks"], response["open_start"])]
 
 
 # --- Frontend ---
-def main():
-    app = application()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DIC Speckle Data Peak Analysis Wizard. Run without arguments to open the wizard.")
+    parser.add_argument("--service", nargs="?", const=f"http://127.0.0.1:{SERVICE_PORT}", metavar="URL",
+                        help="load files and detect peaks with a running analysis service (default: %(const)s)")
+    parser.add_argument("--cache-dir", default=None, help="where results are kept between sessions (default: %s)" % default_cache_dir())
+    parser.add_argument("--cache-size", type=int, default=DISK_CACHE_BYTES // 1024**2, metavar="MB",
+                        help="disk space the kept results may use, the least recently used are deleted first (default: %(default)s)")
+    parser.add_argument("--no-disk-cache", action="store_true", help="do not keep results and parsed files between sessions")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="analyze a directory of CSVs without the wizard")
+    batch.add_argument("inputs", nargs="+", help="csv files or directories containing csv files")
+    batch.add_argument("-g", "--group", action="append", required=True, metavar="COLUMNS[@AGGREGATION][=NAME]",
+                       help="column group using the wizard's range syntax (e.g. 3,4:8=Center) or a header pattern (e.g. 'P*=Points'), may be repeated. "
+                            "Columns are averaged unless an aggregation is given: median, trim:PERCENT or weights:W1,W2,... (e.g. 'P*@median=Points')")
+    batch.add_argument("--slope-threshold", type=float, default=DEFAULT_PARAMETERS["Slope Threshold"])
+    batch.add_argument("--zero-threshold", type=float, default=DEFAULT_PARAMETERS["Zero Threshold"])
+    batch.add_argument("--step", type=int, default=DEFAULT_PARAMETERS["Step"], choices=range(1, 51), metavar="1-50")
+    batch.add_argument("--detector", default=DEFAULT_PARAMETERS["Detector"], choices=list(DETECTORS),
+                       help="peak detection engine (default: %(default)s)")
+    batch.add_argument("--window", type=int, default=DEFAULT_PARAMETERS["Window"], choices=range(1, 501), metavar="1-500",
+                       help="samples the Rolling Slope, Moving Median and Adaptive Zero detectors look back over")
+    batch.add_argument("-s", "--stat", action="append", choices=OPTIONS_NAMES,
+                       help="statistic to output, may be repeated (default: all)")
+    batch.add_argument("-o", "--output-dir", help="where to write the _results.csv files (default: next to each input)")
+    batch.add_argument("--summary", help="also write every file's results to one combined csv")
+    batch.add_argument("--compare", help="also write a cross-specimen table (per peak mean and spread of every statistic) to this .csv, .parquet or .xlsx")
+    batch.add_argument("--chunksize", type=int, default=None,
+                       help="stream each file in chunks of this many rows to cap memory use on very large files")
+    batch.add_argument("--float32", action="store_true",
+                       help="parse values as 32-bit floats, halving memory at the cost of precision past 7 significant digits")
+    batch.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: one per cpu)")
+
+    serve = subparsers.add_parser("serve", help="keep an analysis service running for the wizard and other local programs")
+    serve.add_argument("--port", type=int, default=SERVICE_PORT, help="loopback port to listen on (default: %(default)s)")
+    serve.add_argument("-j", "--workers", type=int, default=None, help="analyses run at once (default: one per cpu)")
+    serve.add_argument("--max-files", type=int, default=8, help="parsed files kept in memory (default: %(default)s)")
+    serve.add_argument("--float32", action="store_true", help="parse values as 32-bit floats, halving memory use")
+    serve.add_argument("--plot-dir", help="folder requests may write plots to, plots are refused without it")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "serve":
+        return run_service(args)
+
+    app = application(args.service, open_disk_cache(args))
     app.mainloop()
 
+def open_disk_cache(args):
+    if args.no_disk_cache:
+        return None
+    try:
+        return DiskCache(args.cache_dir, args.cache_size * 1024**2)
+    except OSError:
+        print("The result cache folder could not be created, results will not be kept between sessions", file=sys.stderr)
+        return None
+
+def run_service(args):
+    from http.server import ThreadingHTTPServer
+
+    service = AnalysisService(args.workers, "float32" if args.float32 else "float64", args.max_files, args.plot_dir, open_disk_cache(args))
+    # Only reachable from this computer
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), None)
+    token = write_service_token(server.server_port)
+    server.RequestHandlerClass = service_handler(service, token)
+
+    # Loaded up front so no request pays for the imports
+    importlib.import_module("pandas")
+    importlib.import_module("matplotlib.figure")
+
+    print(f"Analysis service listening on http://127.0.0.1:{server.server_port} with {service.workers} workers, Ctrl+C to stop", file=sys.stderr)
+    print(f"Token: {token} (also in {service_token_path(server.server_port)}), send it as \"Authorization: Bearer <token>\"", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+def find_csv_files(inputs):
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith(".csv") and not name.endswith("_results.csv"))
+        else:
+            paths.append(path)
+    return paths
+
+def run_batch(args):
+    paths = find_csv_files(args.inputs)
+    if not paths:
+        print("No csv files found", file=sys.stderr)
+        return 1
+
+    group_specs, group_names, aggregations = split_group_args(args.group)
+
+    parameters = {"Slope Threshold": args.slope_threshold, "Zero Threshold": args.zero_threshold, "Step": args.step,
+                  "Window": args.window, "Detector": args.detector}
+    stats = [stat for stat in OPTIONS_NAMES if stat in args.stat] if args.stat else OPTIONS_NAMES
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    summaries = []
+    specimens = []
+    failures = 0
+    total_rows = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(analyze_file, path, group_specs, group_names, parameters, stats, args.chunksize,
+                                   "float32" if args.float32 else "float64", aggregations): path for path in paths}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            prefix = f"[{done}/{len(paths)}] {os.path.basename(path)}:"
+            try:
+                output_data, rows = future.result()
+
+                folder = args.output_dir if args.output_dir else os.path.dirname(path)
+                save_path = os.path.join(folder, os.path.splitext(os.path.basename(path))[0] + "_results.csv")
+                output_data.to_csv(save_path, index=False)
+            except Exception as e:
+                failures += 1
+                print(prefix, "FAILED -", e, file=sys.stderr)
+                continue
+
+            total_rows += rows
+            print(prefix, f"{len(output_data)} peaks, {rows} rows -> {save_path}", file=sys.stderr)
+
+            if args.compare:
+                specimens.append({"path": path, "name": os.path.splitext(os.path.basename(path))[0], "rows": rows, "peaks": len(output_data), "table": output_data})
+
+            if args.summary:
+                summary = output_data.copy()
+                summary.insert(0, "Peak", range(1, len(summary)+1))
+                summary.insert(0, "File", os.path.basename(path))
+                summaries.append(summary)
+
+    if args.summary and summaries:
+        pd.concat(summaries, ignore_index=True).to_csv(args.summary, index=False)
+
+    # In input order whatever order the files finished in
+    if args.compare and specimens:
+        specimens.sort(key=lambda result: paths.index(result["path"]))
+        write_tables(args.compare, {"Comparison": compare_specimens([result["table"] for result in specimens]), "Specimens": specimens_table(specimens)})
+
+    elapsed = time.perf_counter() - start
+    print(f"Analyzed {len(paths)-failures}/{len(paths)} files ({total_rows} rows) in {elapsed:.2f}s, "
+          f"{(len(paths)-failures)/elapsed:.2f} files/s, {total_rows/elapsed:.0f} rows/s", file=sys.stderr)
+
+    return 1 if failures else 0
+
+class JobCancelled(Exception):
+    pass
+
+# Handle passed to work running on the background thread, used to report progress and to notice cancellation
+class Job:
+    def __init__(self, label):
+        self.label = label
+        self.progress = None
+        self.cancelled = threading.Event()
+
+    def check(self, progress=None):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        if progress is not None:
+            self.progress = progress
+
 class application(tk.Tk):
-    def __init__(self):
+    def __init__(self, service=None, disk_cache=None):
         super().__init__()
 
         # Application variables
@@ -103,9 +2210,11 @@ class application(tk.Tk):
         self.default_folder = ""
         self.default_name = ""
         self.df = None
+        self.streaming = False
         self.prev_columns = 0
         self.all_columns = []
         self.column_names = []
+        self.aggregations = []
         self.processed_df = []
         self.processed_data = []
         self.parameters = {}
@@ -113,7 +2222,28 @@ class application(tk.Tk):
         self.save_file_path = ""
         self.output_data = None
         
-        self.options_names = ["Middle", "Median", "Mean", "Maximum"]
+        self.options_names = OPTIONS_NAMES
+
+        self.file_cache = FileCache(disk_cache=disk_cache)
+        self.result_cache = ResultCache()
+        self.trace = StageTrace()
+
+        # Worker processes holding the current file's group columns in shared memory, only for large inputs
+        self.group_pool = None
+
+        # Results kept between sessions, series_key addresses the current group averages in it
+        self.disk_cache = disk_cache
+        self.series_key = None
+
+        # Optional analysis service that loads files and detects peaks in its own warm process
+        self.service = ServiceClient(service) if service else None
+        self.debug_popup = None
+
+        # Heavy work runs one job at a time off the Tk thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.job = None
+        # Following a file polls it on its own thread, so polls never wait for a job or hold one up
+        self.live_executor = ThreadPoolExecutor(max_workers=1)
 
         # Window Setup
         self.title("DIC Speckle Data Peak Analysis Wizard")
@@ -137,6 +2267,14 @@ class application(tk.Tk):
 
         self.restart_button = ttk.Button(self.nav_frame, text="Restart", command=self.go_page1)
 
+        # Progress shown while a job is running
+        self.busy_frame = ttk.Frame(self.nav_frame)
+        self.busy_label = ttk.Label(self.busy_frame)
+        self.busy_label.pack(side='left', padx=10)
+        self.busy_bar = ttk.Progressbar(self.busy_frame, length=150)
+        self.busy_bar.pack(side='left')
+        ttk.Button(self.busy_frame, text="Cancel", command=self.cancel_job).pack(side='left', padx=10)
+
         # Create and store pages
         page_classes = [Page1, Page2, Page3, Page4, Page5]
         self.pages = [PageClass(self.page_container, controller=self) for PageClass in page_classes]
@@ -145,7 +2283,137 @@ class application(tk.Tk):
         self.show_page(0)
 
         
-        self.protocol("WM_DELETE_WINDOW", self.quit)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.bind("<Control-D>", self.show_debug)
+
+        # Page 1 only needs a path, pandas is imported while the user picks the file
+        self.after_idle(preload, "pandas")
+
+    # Send a request to the analysis service, None when there is no service. If the service stops answering the wizard
+    # carries on without it
+    def request_service(self, request):
+        if self.service is None:
+            return None
+        try:
+            return self.service.analyze(request)
+        except OSError:
+            self.service = None
+            return None
+
+    def set_group_pool(self, pool):
+        if self.group_pool is not None and self.group_pool is not pool:
+            self.group_pool.close()
+        self.group_pool = pool
+
+    def close(self):
+        self.cancel_job()
+        self.set_group_pool(None)
+        self.executor.shutdown(wait=False)
+        self.live_executor.shutdown(wait=False, cancel_futures=True)
+        self.quit()
+
+    # Run work(job) on the background thread and call on_done(result) back on the Tk thread.
+    # Starting a job cancels the one already running, so a page only ever sees its latest result
+    def run_job(self, label, work, on_done):
+        self.cancel_job()
+
+        job = Job(label)
+        self.job = job
+        future = self.executor.submit(work, job)
+
+        self.busy_label.config(text=label + "...")
+        self.busy_bar.config(mode='indeterminate', value=0)
+        self.busy_bar.start(10)
+        self.busy_frame.pack(side='left', expand=True)
+
+        self.after(20, self.poll_job, job, future, on_done)
+
+    def poll_job(self, job, future, on_done):
+        if job is not self.job:
+            return
+
+        if not future.done():
+            if job.progress is not None:
+                self.busy_bar.stop()
+                self.busy_bar.config(mode='determinate', value=job.progress*100)
+            self.after(20, self.poll_job, job, future, on_done)
+            return
+
+        self.job = None
+        self.hide_busy()
+        try:
+            result = future.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            tk.messagebox.showwarning(title=job.label + " Failed", message=str(e))
+            return
+        on_done(result)
+
+    def cancel_job(self):
+        if self.job:
+            self.job.cancelled.set()
+            self.job = None
+            self.hide_busy()
+
+    def hide_busy(self):
+        self.busy_bar.stop()
+        self.busy_frame.pack_forget()
+
+    # Hidden debug view, opened with ctrl+shift+d
+    def show_debug(self, *args):
+        if self.debug_popup and self.debug_popup.winfo_exists():
+            self.debug_popup.destroy()
+
+        self.debug_popup = Toplevel(self)
+        self.debug_popup.title("Debug")
+
+        label = ttk.Label(self.debug_popup, justify="left", font="TkFixedFont")
+        label.pack(padx=10, pady=10, anchor="w")
+
+        def refresh():
+            label.config(text=self.file_cache.summary() + "\n\n" + self.result_cache.summary() + "\n\n" +
+                         (self.disk_cache.summary() + "\n\n" if self.disk_cache else "") + self.trace.summary())
+
+        def profile_next():
+            self.trace.profile_next = True
+            refresh()
+
+        buttons = ttk.Frame(self.debug_popup)
+        buttons.pack(fill="x", padx=10, pady=10)
+        ttk.Button(buttons, text="Refresh", command=refresh).pack(side="left")
+        ttk.Button(buttons, text="Clear Cache", command=lambda: (self.file_cache.clear(), self.result_cache.clear(), self.disk_cache and self.disk_cache.clear(), refresh())).pack(side="left", padx=10)
+
+        trace_buttons = ttk.Frame(self.debug_popup)
+        trace_buttons.pack(fill="x", padx=10, pady=(0, 10))
+        ttk.Button(trace_buttons, text="Export Trace", command=self.export_trace).pack(side="left")
+        ttk.Button(trace_buttons, text="Profile Next Stage", command=profile_next).pack(side="left", padx=10)
+        ttk.Button(trace_buttons, text="Save Profile", command=self.save_profile).pack(side="left")
+        ttk.Button(trace_buttons, text="Clear Trace", command=lambda: (self.trace.clear(), refresh())).pack(side="left", padx=10)
+
+        refresh()
+
+    def export_trace(self):
+        path = filedialog.asksaveasfilename(title="Export stage trace", filetypes=(("Trace files", "*.json"),),
+                                            defaultextension=".json", initialfile="dic_trace.json")
+        if path:
+            try:
+                self.trace.export(path)
+            except OSError as e:
+                tk.messagebox.showwarning(title="Export Failed", message=str(e))
+
+    def save_profile(self):
+        if self.trace.profile is None:
+            tk.messagebox.showinfo(title="No Profile", message="Click \"Profile Next Stage\" and run a stage first.")
+            return
+        name, profiler = self.trace.profile
+        path = filedialog.asksaveasfilename(title="Save profile", filetypes=(("Profile files", "*.prof"),),
+                                            defaultextension=".prof", initialfile=name.replace(".", "_") + ".prof")
+        if path:
+            try:
+                profiler.dump_stats(path)
+            except OSError as e:
+                tk.messagebox.showwarning(title="Save Failed", message=str(e))
 
     def show_page(self, index, prev=-1):
         if prev != -1:
@@ -168,26 +2436,30 @@ class application(tk.Tk):
         else:
             self.restart_button.pack_forget()
 
+    # The page being left may finish its work in the background first, it calls go when the next page can be shown
+    def navigate(self, index):
+        prev_page_index = self.current_page_index
+
+        def go():
+            self.current_page_index = index
+            self.show_page(index, prev=prev_page_index)
+
+        self.pages[prev_page_index].leave(index, go)
+
     def go_back(self):
         if self.current_page_index > 0:
-            prev_page_index = self.current_page_index
-            self.current_page_index -= 1
-            self.show_page(self.current_page_index, prev=prev_page_index)
+            self.navigate(self.current_page_index - 1)
 
     def go_next(self):
         if self.current_page_index < len(self.pages) - 1:
-            prev_page_index = self.current_page_index
-            self.current_page_index += 1
-            self.show_page(self.current_page_index, prev=prev_page_index)
+            self.navigate(self.current_page_index + 1)
         else:
             result = tk.messagebox.askyesno(title="Confirm Finish", message="Do you want to close the wizard?")
             if result:
-                self.quit()
+                self.close()
     
     def go_page1(self):
-        prev_page_index = self.current_page_index
-        self.current_page_index = 0
-        self.show_page(self.current_page_index, prev=prev_page_index)
+        self.navigate(0)
 
 class Page_Template(ttk.Frame, ABC):
     def __init__(self, parent, controller):
@@ -200,6 +2472,124 @@ class Page_Template(ttk.Frame, ABC):
     def on_exit(self):
         pass
 
+    def leave(self, index, go):
+        go()
+
+# Column key that only creates Treeview rows for the columns in view, so files with thousands of columns show instantly.
+# The selection is kept as column indices and supports click, ctrl+click and shift+click like a normal Treeview
+class ColumnKey(ttk.Frame):
+    def __init__(self, parent, on_select):
+        super().__init__(parent)
+        self.on_select = on_select
+        self.headers = []
+        self.offset = 0
+        self.visible = 20
+        self.selected = set()
+        self.anchor = None
+
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        # select every column whose header matches a pattern such as P*
+        self.pattern_text = tk.StringVar()
+        pattern = ttk.Frame(self)
+        pattern.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 5))
+        pattern_box = ttk.Entry(pattern, textvariable=self.pattern_text, width=10)
+        pattern_box.pack(side="left", fill="x", expand=True)
+        pattern_box.bind("<Return>", self.select_pattern)
+        ttk.Button(pattern, text="Match", width=6, command=self.select_pattern).pack(side="left", padx=(5, 0))
+
+        self.tree = ttk.Treeview(self, columns=("index", "heading"), show='headings', selectmode="none")
+        self.tree.heading("index", text="Index")
+        self.tree.heading("heading", text="Heading")
+        self.tree.column("index", width=40, anchor="center")
+        self.tree.column("heading", width=80)
+        self.tree.grid(row=1, column=0, sticky="nsew")
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.scroll)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+
+        self.tree.bind("<Configure>", self.resize)
+        self.tree.bind("<Button-1>", self.click)
+        self.tree.bind("<Control-Button-1>", lambda event: self.click(event, toggle=True))
+        self.tree.bind("<Shift-Button-1>", lambda event: self.click(event, extend=True))
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll("scroll", -1 if event.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda event: self.scroll("scroll", -1, "units"))
+        self.tree.bind("<Button-5>", lambda event: self.scroll("scroll", 1, "units"))
+
+    def set_headers(self, headers):
+        self.headers = [str(header) for header in headers]
+        self.selected = set()
+        self.anchor = None
+        self.offset = 0
+        self.render()
+
+    def resize(self, event):
+        row_height = ttk.Style().lookup("Treeview", "rowheight") or 20
+        # Room for the heading, a partly visible last row is fine
+        self.visible = max(1, (event.height - 25) // int(row_height) + 1)
+        self.render()
+
+    def render(self):
+        self.offset = max(0, min(self.offset, len(self.headers) - self.visible))
+        rows = range(self.offset, min(self.offset + self.visible, len(self.headers)))
+
+        # The same Treeview rows are reused while scrolling, only their values change
+        items = self.tree.get_children()
+        for i, column in enumerate(rows):
+            if i < len(items):
+                self.tree.item(items[i], values=(column, self.headers[column]))
+            else:
+                self.tree.insert("", tk.END, values=(column, self.headers[column]))
+        if len(items) > len(rows):
+            self.tree.delete(*items[len(rows):])
+
+        items = self.tree.get_children()
+        self.tree.selection_set([item for item, column in zip(items, rows) if column in self.selected])
+
+        total = max(len(self.headers), 1)
+        self.scrollbar.set(self.offset / total, min(self.offset + self.visible, total) / total)
+
+    def scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(float(amount) * len(self.headers))
+        else:
+            self.offset += int(amount) * (self.visible if unit == "pages" else 1)
+        self.render()
+
+    def click(self, event, toggle=False, extend=False):
+        item = self.tree.identify_row(event.y)
+        if not item:
+            return "break"
+        column = self.offset + self.tree.index(item)
+
+        if extend and self.anchor is not None:
+            low, high = sorted((self.anchor, column))
+            self.selected = set(range(low, high+1))
+        elif toggle:
+            self.selected ^= {column}
+            self.anchor = column
+        else:
+            self.selected = {column}
+            self.anchor = column
+
+        self.render()
+        self.on_select(sorted(self.selected))
+        # Stops the Treeview's own selection handling
+        return "break"
+
+    def select_pattern(self, *args):
+        columns = match_columns(self.pattern_text.get(), self.headers)
+        if not columns:
+            tk.messagebox.showwarning(title="No Matching Columns", message="No column headings match " + repr(self.pattern_text.get()) + ". Use * for any text and ? for one character (e.g. P*).")
+            return
+
+        self.selected = set(columns)
+        self.anchor = None
+        self.offset = columns[0]
+        self.render()
+        self.on_select(columns)
+
 class Page1(Page_Template):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
@@ -221,9 +2611,16 @@ class Page1(Page_Template):
         self.display_box = ttk.Entry(self, textvariable=self.entry_text)
         self.display_box.grid(row=1, column=0, sticky="ew", pady=10, padx=10)
 
+        # 32-bit values halve the memory a very large export takes
+        self.low_memory = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self, text="Low memory (32-bit values)", variable=self.low_memory, command=self.set_dtype).grid(row=2, column=0, columnspan=2, sticky="w", padx=10)
+
     def on_enter(self):
         self.check_path()
 
+    def set_dtype(self):
+        self.controller.file_cache.dtype = "float32" if self.low_memory.get() else "float64"
+
     # Open a file upload
     def upload_csv(self):
         self.entry_text.set(filedialog.askopenfilename(title="Select a CSV file", filetypes=(("CSV files", "*.csv"),)))
@@ -255,32 +2652,29 @@ class Page2(Page_Template):
         self.entry_text.trace_add("write", self.entry_update)
         
         self.name_text = tk.StringVar()
+        self.aggregation_text = tk.StringVar(value=AGGREGATIONS[0])
 
         # title label
-        ttk.Label(self, text="Choose Column Groupings").grid(row=0, column=0, columnspan=3, pady=20)
+        ttk.Label(self, text="Choose Column Groupings").grid(row=0, column=0, columnspan=4, pady=20)
 
         # key table
-        self.key = ttk.Treeview(self, columns=("index", "heading"), show='headings', height=100)
-        self.key.heading("index", text="Index")
-        self.key.heading("heading", text="Heading")
-        self.key.column("index", width=40, anchor="center")
-        self.key.column("heading", width=80)
-        self.key.bind("<<TreeviewSelect>>", self.key_select)
-        self.key.grid(row=4, column=2, pady=10, padx=10)
+        self.key = ColumnKey(self, self.key_select)
+        self.key.grid(row=4, column=3, pady=10, padx=10, sticky="ns")
 
         # buttons
         self.button_add = ttk.Button(self, text="Add Data Column", command=self.list_add)
-        self.button_add.grid(row=1, column=2, pady=10, padx=10, sticky='ew')
+        self.button_add.grid(row=1, column=3, pady=10, padx=10, sticky='ew')
 
         self.button_remove = ttk.Button(self, text="Remove Last Added", command=self.list_remove)
-        self.button_remove.grid(row=2, column=2, pady=10, padx=10, sticky='ew')
+        self.button_remove.grid(row=2, column=3, pady=10, padx=10, sticky='ew')
 
         self.button_clear = ttk.Button(self, text="Clear All", command=self.list_clear)
-        self.button_clear.grid(row=3, column=2, pady=10, padx=10, sticky='ew')
+        self.button_clear.grid(row=3, column=3, pady=10, padx=10, sticky='ew')
 
         # field labels
         ttk.Label(self, text="Column(s) Range").grid(row=1, column=0, padx=10, pady=8, sticky='sw')
         ttk.Label(self, text="Group Name").grid(row=1, column=1, padx=10, pady=8, sticky='sw')
+        ttk.Label(self, text="Combine Columns By").grid(row=1, column=2, padx=10, pady=8, sticky='sw')
 
         # range field
         vcmd = (self.register(self.valid_key), '%P')
@@ -289,6 +2683,8 @@ class Page2(Page_Template):
         # name field
         self.display_box = ttk.Entry(self, textvariable=self.name_text)
         self.display_box.grid(row=2, column=1, sticky="ew", pady=10, padx=10)
+        # aggregation field, the presets can be edited (trim:20, weights:1,2,1)
+        ttk.Combobox(self, textvariable=self.aggregation_text, values=AGGREGATIONS, width=16).grid(row=2, column=2, sticky="ew", pady=10, padx=10)
 
         # Range List
         self.list = tk.Listbox(self)
@@ -296,17 +2692,39 @@ class Page2(Page_Template):
         # Name List
         self.name_list = tk.Listbox(self)
         self.name_list.grid(row=3, column=1, rowspan=2, sticky="nsew", pady=10, padx=10)
+        # Aggregation List
+        self.aggregation_list = tk.Listbox(self, width=16)
+        self.aggregation_list.grid(row=3, column=2, rowspan=2, sticky="nsew", pady=10, padx=10)
         
         self.button_add.config(state='disabled')
 
     def on_enter(self):
-        self.controller.df = pd.read_csv(self.controller.csv_file_path)
         self.entry_text.set("")
-        
-        self.key.delete(*self.key.get_children())
-        for i, col in enumerate(self.controller.df.columns):
-            self.key.insert("", tk.END, values=(i, col))
-        
+        self.key.set_headers([])
+        self.controller.df = None
+        self.controller.next_button.config(state='disabled')
+
+        self.controller.run_job("Loading file", self.load_csv, self.show_columns)
+
+    # Runs on the background thread
+    def load_csv(self, job):
+        path = self.controller.csv_file_path
+
+        with self.controller.trace.span("Page2.on_enter") as info:
+            # Very large files are only read in chunks when the groups are averaged on Page 3
+            streaming = os.path.getsize(path) > STREAM_THRESHOLD
+            if streaming:
+                df = pd.DataFrame(columns=read_dic_header(path)[0])
+            else:
+                df = self.controller.file_cache.read_csv(path)
+            info["rows"], info["columns"] = df.shape
+        return streaming, df
+
+    def show_columns(self, result):
+        self.controller.streaming, self.controller.df = result
+
+        self.key.set_headers(self.controller.df.columns)
+
         new_columns = len(self.controller.df.columns)
         if self.controller.prev_columns != new_columns:
             self.controller.prev_columns = new_columns
@@ -314,31 +2732,8 @@ class Page2(Page_Template):
 
         self.list_updated()
     
-    def key_select(self, *args):
-        items = self.key.selection()
-
-        select_str = ""
-        in_range = False
-        prev = -100
-
-        for item in items:
-            id = self.key.index(item)
-
-            if prev == -100:
-                select_str = str(id)
-            elif prev == id-1:
-                if in_range:
-                    select_str = select_str[:select_str.rfind(":") + 1] + str(id)
-                else:
-                    in_range = True
-                    select_str += ":" + str(id)
-            elif prev < id-1:
-                in_range = False
-                select_str += "," + str(id)
-            
-            prev = id
-        
-        self.entry_text.set(select_str)
+    def key_select(self, columns):
+        self.entry_text.set(column_range_string(columns))
 
     def check_proceed(self):
         if len(self.controller.all_columns)>0:
@@ -353,6 +2748,8 @@ class Page2(Page_Template):
         return all(c in allowed_chars for c in entry_text)
 
     def list_add(self):
+        if self.controller.df is None:
+            return
         self.validate_range(self.entry_text.get())
         # self.list.insert(tk.END, self.entry_text.get())
         self.list_updated()
@@ -362,6 +2759,8 @@ class Page2(Page_Template):
         self.controller.all_columns.pop()
         self.name_list.delete(tk.END)
         self.controller.column_names.pop()
+        self.aggregation_list.delete(tk.END)
+        self.controller.aggregations.pop()
         self.list_updated()
 
     def list_clear(self):
@@ -369,6 +2768,8 @@ class Page2(Page_Template):
         self.controller.all_columns = []
         self.name_list.delete(0, tk.END)
         self.controller.column_names = []
+        self.aggregation_list.delete(0, tk.END)
+        self.controller.aggregations = []
         self.list_updated()
 
     def entry_update(self, *args):
@@ -387,131 +2788,37 @@ class Page2(Page_Template):
         self.check_proceed()
     
     def validate_range(self, input_str):
-        prev = 'start'
-        curr = 'start'
-
-        valid = True
-        range_str = ""
-        ranges = []
-        error_message = ""
-
-        after_colon = False
-
-        if not input_str[0].isdigit() or not input_str[len(input_str)-1].isdigit():
-            curr = 'invalid'
-            error_message = "Column groups must start and end with digits (good 3,4:8 - bad ,2:8,10:)"
-            valid = False
-
-        for char in input_str:
-
-            prev = curr
-            curr = 'digit' if char.isdigit() else 'colon' if char == ":" else 'comma'
-
-            if curr == 'colon':
-                if after_colon:
-                    valid = False
-                    error_message = "Ranges may only include a single colon (good 3:8 - bad 1:8:3)"
-                    break
-                else:
-                    after_colon = True
-
-            match prev:
-
-                case 'start':
-                    range_str += char
-
-                case 'digit':
-                    if curr == 'comma':
-                        ranges.append(range_str)
-                        range_str = ""
-                        after_colon = False
-                    else:
-                        range_str += char
-
-                case 'colon':
-                    if curr != 'digit':
-                        valid = False
-                        error_message = "Colons must be followed by digits (good 2:4 - bad 1:,10)"
-                        break
-                    else:
-                        range_str += char
-
-                case 'comma':
-                    if curr != 'digit':
-                        valid = False
-                        error_message = "Commas must be followed by digits (good 1,2,9 - bad 2,,3)"
-                        break
-                    else:
-                        range_str += char
-
-        if valid:
-            ranges.append(range_str)
-            # self.list.insert(tk.END, input_str)
-            self.add_ranges(ranges, input_str)
+        aggregation = self.aggregation_text.get().strip().lower() or AGGREGATIONS[0]
+        try:
+            columns = parse_column_range(input_str, self.controller.df.shape[1])
+            parse_aggregation(aggregation, len(columns))
+        except ValueError as e:
+            tk.messagebox.showwarning(title="Invalid Column Group", message=str(e))
         else:
-            tk.messagebox.showwarning(title="Invalid Column Group", message=error_message)
+            self.add_ranges(columns, input_str, aggregation)
     
-    def add_ranges(self, ranges, input_str):
-        columns = []
-
-        valid = True
-        error_message = ""
-
-        for range_str in ranges:
-            if ":" in range_str:
-                colon_ind = range_str.index(":")
-                col_start = int(range_str[:colon_ind])
-                col_end = int(range_str[colon_ind+1:])
-
-                for i in range(min(col_start,col_end), max(col_start,col_end)+1):
-                    if self.verify_index(i):
-                        if i in columns:
-                            valid = False
-                            error_message = "Ranges may not inlude duplicate columns (good 2,4:6 - bad 3,2:7)"
-                        else:
-                            columns.append(i)
-                    else:
-                        valid = False
-                        error_message = "One or more specified columns are out of bounds"
-            else:
-                if self.verify_index(int(range_str)):
-                    if int(range_str) in columns:
-                        valid = False
-                        error_message = "Ranges may not inlude duplicate columns (good 2,4:6 - bad 3,2:7)"
-                    else:
-                        columns.append(int(range_str))
-                else:
-                    valid = False
-                    error_message = "One or more specified columns are out of bounds"
-        
-        if (valid):
-            self.list.insert(tk.END, input_str)
-            self.controller.all_columns.append(columns)
-            self.entry_text.set("")
+    def add_ranges(self, columns, input_str, aggregation):
+        self.list.insert(tk.END, input_str)
+        self.controller.all_columns.append(columns)
+        self.entry_text.set("")
 
-            column_name = self.get_column_name(columns, input_str)
-            
-            self.name_list.insert(tk.END, column_name)
-            self.controller.column_names.append(column_name)
-            self.name_text.set("")
-        else:
-            tk.messagebox.showwarning(title="Invalid Column Group", message=error_message)
+        self.aggregation_list.insert(tk.END, aggregation)
+        self.controller.aggregations.append(aggregation)
+
+        column_name = self.get_column_name(columns, input_str, aggregation)
+        
+        self.name_list.insert(tk.END, column_name)
+        self.controller.column_names.append(column_name)
+        self.name_text.set("")
     
-    def get_column_name(self, columns, input_str):
+    def get_column_name(self, columns, input_str, aggregation):
         input_name = self.name_text.get()
         if input_name == "":
-            if (len(columns) == 1):
-                return self.controller.df.columns[columns[0]]
-            else:
-                return "Avg "+input_str
+            return default_group_name(columns, input_str, self.controller.df.columns, aggregation)
         else:
             return input_name
 
 
-    def verify_index(self, index):
-        return self.controller.df.shape[1] > index
-
-
 class Page3(Page_Template):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
@@ -523,55 +2830,157 @@ class Page3(Page_Template):
         self.visible_lines = []
 
         self.popup = None
+        self.dfs_ready = False
+        # The group averages and settings controller.processed_data was detected from
+        self.detected_df = None
+        self.detected_parameters = None
 
         ttk.Label(self, text="Adjust Settings").grid(row=0, column=0, columnspan=4, pady=20)
 
         self.button_vis=ttk.Button(self, text="Visualize", command=self.visualize)
+        self.button_tune=ttk.Button(self, text="Auto-Tune", command=self.auto_tune)
 
         self.settings = {
-            "Slope Threshold" : [None, None, None, tk.DoubleVar(), 0.15, "The maximum magnitude of a line's slope that can be considered flat (part of a peak). Increase to widen peaks; decrease to narrow peaks.", 0, -1],
-            "Zero Threshold" : [None, None, None, tk.DoubleVar(), 0.5, "The minimum y-value of a point to be detected as part of a peak. Increase to avoid false peaks in zero-ranges; decrease to avoid missing lower peaks.", 0, -1],
-            "Step" : [None, None, None, tk.IntVar(), 1, "The frequency at which points are sampled (check slope every [1] point, [2] points, [50] points). Accepts integer values 1-50. Increase to smooth rough data; decrease to detect fine fluctuations.", 1, 50]
+            "Slope Threshold" : [None, None, None, tk.DoubleVar(), DEFAULT_PARAMETERS["Slope Threshold"], "The maximum magnitude of a line's slope that can be considered flat (part of a peak). Increase to widen peaks; decrease to narrow peaks.", 0, -1],
+            "Zero Threshold" : [None, None, None, tk.DoubleVar(), DEFAULT_PARAMETERS["Zero Threshold"], "The minimum y-value of a point to be detected as part of a peak. Increase to avoid false peaks in zero-ranges; decrease to avoid missing lower peaks. The Adaptive Zero detector measures it from each group's resting level instead of from zero.", 0, -1],
+            "Step" : [None, None, None, tk.IntVar(), DEFAULT_PARAMETERS["Step"], "The frequency at which points are sampled (check slope every [1] point, [2] points, [50] points). Accepts integer values 1-50. Increase to smooth rough data; decrease to detect fine fluctuations.", 1, 50],
+            "Window" : [None, None, None, tk.IntVar(), DEFAULT_PARAMETERS["Window"], "The number of samples the Rolling Slope, Moving Median and Adaptive Zero detectors look back over. Accepts integer values 1-500. Increase to ignore longer bursts of noise; decrease to keep short peaks. The Slope detector ignores it.", 1, 500]
         }
-        
+
+        # peak detection engine
+        self.detector = tk.StringVar(value=DEFAULT_PARAMETERS["Detector"])
+        self.detector.trace_add("write", self.update_global_parameters)
+        ttk.Label(self, text="Detector").grid(row=1, column=0, pady=10, padx=10)
+        ttk.Combobox(self, textvariable=self.detector, values=list(DETECTORS), state="readonly").grid(row=1, column=1, pady=10, padx=10, sticky="ew")
+        ttk.Button(self, text="↻", width=3, command=lambda: self.detector.set(DEFAULT_PARAMETERS["Detector"])).grid(row=1, column=2, pady=10, padx=10)
+        ttk.Button(self, text="?", width=3, command=self.detector_help).grid(row=1, column=3, pady=10, padx=10)
+
         vcmd = (self.register(self.valid_key), '%P')
 
         for index, (key, value) in enumerate(self.settings.items()):
             self.settings[key][0] = ttk.Entry(self, textvariable=self.settings[key][3], validate="key", validatecommand=vcmd)
-            self.settings[key][0].grid(row=index+1, column=1, pady=10, padx=10, sticky="ew")
+            self.settings[key][0].grid(row=index+2, column=1, pady=10, padx=10, sticky="ew")
             self.settings[key][3].trace_add("write", self.update_global_parameters)
             self.reset(key)
             
             self.settings[key][1] = ttk.Button(self, text="↻", width=3, command=lambda k=key: self.reset(k))
-            self.settings[key][1].grid(row=index+1, column=2, pady=10, padx=10)
+            self.settings[key][1].grid(row=index+2, column=2, pady=10, padx=10)
             
             self.settings[key][2] = ttk.Button(self, text="?", width=3, command=lambda k=key: self.help(k))
-            self.settings[key][2].grid(row=index+1, column=3, pady=10, padx=10)
+            self.settings[key][2].grid(row=index+2, column=3, pady=10, padx=10)
 
-            ttk.Label(self, text=key).grid(row=index+1, column=0, pady=10, padx=10)
+            ttk.Label(self, text=key).grid(row=index+2, column=0, pady=10, padx=10)
         
-        self.button_vis.grid(row=4, column=0, columnspan=4, padx=10, pady=10)
+        self.button_vis.grid(row=len(self.settings)+2, column=0, columnspan=2, padx=10, pady=10, sticky="e")
+        self.button_tune.grid(row=len(self.settings)+2, column=2, columnspan=2, padx=10, pady=10, sticky="w")
     
     def on_enter(self):
-        self.gen_dfs()
+        self.dfs_ready = False
         self.update_global_parameters()
         self.update_next_button(False)
 
-    def on_exit(self):
-        self.process()
+        self.controller.run_job("Averaging column groups", self.gen_dfs, self.set_dfs)
+
+    # The next pages need the peaks for the current settings. They are reused when Visualize already found them and
+    # are processed in the background otherwise, going back needs nothing
+    def leave(self, index, go):
+        if index < self.controller.current_page_index:
+            self.controller.cancel_job()
+            go()
+            return
+        if self.detected_df is self.controller.processed_df and self.detected_parameters == self.controller.parameters:
+            go()
+            return
+
+        processed_df = self.controller.processed_df
+        parameters = dict(self.controller.parameters)
+
+        def work(job):
+            with self.controller.trace.span("Page3.process", rows=len(processed_df[0]) if processed_df else 0, columns=len(processed_df)):
+                return self.process_groups(processed_df, parameters, progress=job.check)
+
+        def done(processed_data):
+            # The settings were edited while the job ran, the result is stale
+            if parameters != self.controller.parameters:
+                return
+            self.set_processed(processed_data, processed_df, parameters)
+            go()
+
+        self.controller.run_job("Processing groups", work, done)
 
     def update_next_button(self, val):
         self.controller.next_button.config(state='normal' if val else 'disabled')
 
-    def gen_dfs(self):
-        df_clean = self.controller.df.apply(pd.to_numeric, errors='coerce').dropna()
-        df_clean *= 100
-        
-        self.controller.processed_df = []
-        for i, group in enumerate(self.controller.all_columns):
-            averaged = df_clean.iloc[:, group].mean(axis=1)
-            new_df = pd.DataFrame({self.controller.column_names[i] : averaged})
-            self.controller.processed_df.append(new_df)
+    # Runs on the background thread, returns the group averages, the group pool holding them (if one was used),
+    # their disk cache key and the settings they were last analyzed with (if they were read from the disk cache)
+    def gen_dfs(self, job):
+        columns, groups = select_columns(self.controller.all_columns)
+        path = self.controller.csv_file_path
+        disk = self.controller.disk_cache
+
+        with self.controller.trace.span("Page3.gen_dfs", columns=len(columns)) as info:
+            response = self.controller.request_service(self.service_request(values=True, detect=False))
+            if response is not None:
+                info["service"] = True
+                return service_frames(response), None, None, None
+
+            key = disk.series_key(path, self.controller.all_columns, self.controller.file_cache.dtype, self.controller.aggregations) if disk else None
+            processed_df = disk.load_series(key, self.controller.column_names) if disk else None
+            pool = None
+
+            if processed_df is not None:
+                info["disk"] = True
+            elif self.controller.streaming:
+                stream = stream_file(path, self.controller.all_columns, self.controller.column_names, progress=job.check, aggregations=self.controller.aggregations)
+                processed_df = stream.processed_df()
+            else:
+                df_clean = self.controller.file_cache.clean(path, columns)
+                # Many long groups are averaged and later detected on every core
+                if use_group_pool(df_clean.shape[0], groups):
+                    pool = GroupPool(df_clean, groups)
+                    info["workers"] = pool.workers
+                    try:
+                        processed_df = pool.average(self.controller.column_names, self.controller.aggregations, progress=job.check)
+                    except BaseException:
+                        pool.close()
+                        raise
+                else:
+                    processed_df = average_groups(df_clean, groups, self.controller.column_names, self.controller.aggregations)
+
+            if disk and not info.get("disk"):
+                disk.save_series(key, processed_df)
+            info["rows"] = len(processed_df[0]) if processed_df else 0
+        return processed_df, pool, key, disk.load_last(key) if info.get("disk") else None
+
+    def set_dfs(self, result):
+        processed_df, pool, series_key, last = result
+        self.controller.set_group_pool(pool)
+        self.controller.processed_df = processed_df
+        self.controller.series_key = series_key
+        self.dfs_ready = True
+        self.update_global_parameters()
+
+        if last and last["names"] == self.controller.column_names:
+            self.offer_last(last)
+
+    # The same file and groups were analyzed before, their peaks and statistics are on disk so the results open right away
+    def offer_last(self, last):
+        if not tk.messagebox.askyesno(title="Previous Results", message=f"This file was analyzed with these column groups on {last['time']}. "
+                                      "Open the results with the same settings and statistics?"):
+            return
+
+        self.detector.set(last["parameters"].get("Detector", DEFAULT_PARAMETERS["Detector"]))
+        for key, value in last["parameters"].items():
+            if key in self.settings:
+                self.settings[key][3].set(value)
+
+        page4 = self.controller.pages[3]
+        for name, var in zip(self.controller.options_names, page4.checkvars):
+            var.set(name in last["stats"])
+        page4.update_stats()
+
+        # Leaving this page processes the groups, which reads the peaks from disk
+        self.controller.navigate(len(self.controller.pages) - 1)
     
     def valid_key(self, entry_text):
         if entry_text == "":
@@ -580,10 +2989,12 @@ class Page3(Page_Template):
         return all(c in allowed_chars for c in entry_text)
 
     def update_global_parameters(self, *args):
-        self.button_vis.config(state='normal')
+        self.button_vis.config(state='normal' if self.dfs_ready else 'disabled')
+        self.button_tune.config(state='normal' if self.dfs_ready else 'disabled')
         # self.controller.next_button.config(state='normal')
         self.update_next_button(False)
 
+        self.controller.parameters["Detector"] = self.detector.get()
         for index, (key, value) in enumerate(self.settings.items()):
             try:
                 field_value = value[3].get()
@@ -606,40 +3017,98 @@ class Page3(Page_Template):
     
     def help(self, key):
         tk.messagebox.showwarning(title="Help: "+key, message=self.settings[key][5])
+
+    def detector_help(self):
+        tk.messagebox.showwarning(title="Help: Detector", message="\n\n".join(name + ": " + detector.description for name, detector in DETECTORS.items()))
     
-    def process(self):
-        self.controller.processed_data = []
-        prev_groups = -1
-        self.update_next_button(True)
-        for df in self.controller.processed_df:
-            processed_group = process_data(df, 
-                change_sense=self.controller.parameters["Slope Threshold"], 
-                zero_threshold=self.controller.parameters["Zero Threshold"], 
-                step=self.controller.parameters["Step"])
-
-            self.controller.processed_data.append(processed_group)
-            if (prev_groups != -1 and prev_groups != len(processed_group[1])):
-                self.update_next_button(False)
-            prev_groups = len(processed_group[1])
-        
-        
+    # The groups and settings in the analysis service's request format
+    def service_request(self, parameters=None, **options):
+        return dict(options, path=self.controller.csv_file_path, parameters=parameters or {}, stats=[],
+                    groups=[column_range_string(columns) + "@" + aggregation + "=" + name
+                            for columns, name, aggregation in zip(self.controller.all_columns, self.controller.column_names, self.controller.aggregations)])
+
+    def process_groups(self, processed_df, parameters, progress=None):
+        response = self.controller.request_service(self.service_request(parameters))
+        if response is not None:
+            return service_groups(response, processed_df)
+        # Peaks of averages from this session's file and groups are kept on disk
+        disk, series_key = self.controller.disk_cache, self.controller.series_key
+        if disk and series_key and processed_df is self.controller.processed_df:
+            peaks_key = disk.peaks_key(series_key, parameters)
+            processed_data = disk.load_peaks(peaks_key, processed_df)
+            if processed_data is not None:
+                return processed_data
+
+        pool = self.controller.group_pool
+        processed_data = process_groups(processed_df, parameters, self.controller.result_cache, progress=progress,
+                                        pool=pool if pool is not None and pool.frames is processed_df else None)
+        if disk and series_key and processed_df is self.controller.processed_df:
+            disk.save_peaks(peaks_key, processed_data)
+        return processed_data
+
+    # Search for the settings where every group agrees on the number of peaks, fill them in and show the result
+    def auto_tune(self):
+        processed_df = self.controller.processed_df
+        detector, window = self.controller.parameters["Detector"], self.controller.parameters["Window"]
+        self.controller.run_job("Tuning settings", lambda job: sweep_parameters(processed_df, progress=job.check, detector=detector, window=window), self.apply_tuning)
+
+    def apply_tuning(self, ranked):
+        best = ranked[0]
+        if best["agreement"] < 1 or best["peaks"] == 0:
+            tk.messagebox.showwarning(title="Auto-Tune", message="No settings were found where every group detects the same number of peaks. Try different column groups or adjust the settings by hand.")
+            return
+
+        for key, value in best["parameters"].items():
+            self.settings[key][3].set(value)
+
+        self.visualize()
+        tk.messagebox.showinfo(title="Auto-Tune", message=f"Every group detects {best['peaks']} peaks with these settings, "
+                               f"and {best['stability']:.0%} of similar settings give the same result. Check the graph before moving on.")
+
+    def set_processed(self, processed_data, processed_df, parameters):
+        self.controller.processed_data = processed_data
+        self.detected_df = processed_df
+        self.detected_parameters = parameters
+
+        peak_counts = set(len(group[1]) for group in self.controller.processed_data)
+        self.update_next_button(len(peak_counts) <= 1)
 
     def visualize(self):
-        self.process()
+        processed_df = self.controller.processed_df
+        parameters = dict(self.controller.parameters)
+        title = os.path.splitext(os.path.basename(self.controller.csv_file_path))[0]
+
+        def work(job):
+            with self.controller.trace.span("Page3.visualize", rows=len(processed_df[0]) if processed_df else 0, columns=len(processed_df)):
+                processed_data = self.process_groups(processed_df, parameters, progress=job.check)
+                return parameters, processed_df, processed_data, plot_processed_data(processed_data, title)
+
+        self.controller.run_job("Processing groups", work, self.show_popup)
+
+    def show_popup(self, result):
+        parameters, processed_df, processed_data, (fig, group_refs) = result
+
+        # The settings were edited while the job ran, the result is stale
+        if parameters != self.controller.parameters:
+            return
+        self.set_processed(processed_data, processed_df, parameters)
 
         graph_count=0
 
         if self.popup and self.popup.winfo_exists():
-            self.popup.destroy()
-            self.popup = None
+            self.close_popup()
 
         self.popup = Toplevel()
         self.popup.title("Processed Data Preview")
+        self.popup.protocol("WM_DELETE_WINDOW", self.close_popup)
 
         self.popup.visible_lines = []
+        self.popup.labels = []
 
         for i, df in enumerate(self.controller.processed_df):
-            ttk.Label(self.popup, text=self.controller.column_names[i] + " (" + str(len(self.controller.processed_data[i][1])) + " peaks)").grid(row=0, column=i, padx=10, pady=10)
+            label = ttk.Label(self.popup, text=self.peak_label(i, len(self.controller.processed_data[i][1])))
+            label.grid(row=0, column=i, padx=10, pady=10)
+            self.popup.labels.append(label)
 
             self.popup.visible_lines.append(tk.BooleanVar(value=True))
             cb = ttk.Checkbutton(self.popup, variable=self.popup.visible_lines[i], command=self.refresh)
@@ -647,13 +3116,145 @@ class Page3(Page_Template):
 
             graph_count += 1
 
-        self.popup.fig, self.popup.group_refs = plot_processed_data(self.controller.processed_data, os.path.splitext(os.path.basename(self.controller.csv_file_path))[0])
+        self.popup.fig, self.popup.group_refs = fig, group_refs
 
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
         self.popup.canvas = FigureCanvasTkAgg(self.popup.fig, master=self.popup)
+
+        # Groups are drawn over a cached background so toggling them only redraws the groups
+        for group in self.popup.group_refs:
+            for object in group:
+                object.set_animated(True)
+        self.popup.background = None
+        self.popup.canvas.mpl_connect("draw_event", self.on_draw)
+
         self.popup.canvas.draw()
         self.popup.canvas.get_tk_widget().grid(row=2, column=0, columnspan=graph_count, padx=10, pady=10)
 
-        ttk.Button(self.popup, text="Close", command=self.popup.destroy).grid(row=3, column=0, columnspan=graph_count, pady=10)
+        # Follow the file while the DIC software is still writing it
+        self.popup.live = None
+        self.popup.live_poll = None
+        self.popup.live_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.popup, text="Follow file as it is written", variable=self.popup.live_var, command=self.toggle_live).grid(row=3, column=0, columnspan=graph_count)
+
+        ttk.Button(self.popup, text="Close", command=self.close_popup).grid(row=4, column=0, columnspan=graph_count, pady=10)
+
+    def peak_label(self, i, peak_count):
+        return self.controller.column_names[i] + " (" + str(peak_count) + " peaks)"
+
+    def close_popup(self):
+        self.stop_live()
+        self.popup.destroy()
+
+    def toggle_live(self):
+        if not self.popup.live_var.get():
+            self.stop_live()
+            return
+
+        live = LiveFile(self.controller.csv_file_path, self.controller.all_columns, self.controller.column_names, dict(self.controller.parameters), self.controller.aggregations)
+        self.popup.live = live
+        self.popup.live_started = False
+
+        # The first poll reads everything written so far, later ones only the new lines
+        self.poll_live(live)
+
+    def read_live(self, live, job):
+        try:
+            return live.poll(progress=job.check)
+        except (OSError, ValueError, pd.errors.ParserError) as e:
+            return e
+
+    # Polls run on the controller's live thread, the Tk thread only checks for their result
+    def poll_live(self, live):
+        if self.popup and self.popup.winfo_exists() and self.popup.live is live:
+            job = Job("Following file")
+            self.popup.live_poll = (job, self.controller.live_executor.submit(self.read_live, live, job))
+            self.after(20, self.check_live, live, *self.popup.live_poll)
+
+    def check_live(self, live, job, future):
+        if not future.done():
+            self.after(20, self.check_live, live, job, future)
+            return
+        # Stopped while polling, stop_live hands the data over
+        if job.cancelled.is_set():
+            return
+        self.live_update(live, future.result())
+
+    def live_update(self, live, update):
+        if not (self.popup and self.popup.winfo_exists() and self.popup.live is live):
+            return
+
+        if isinstance(update, Exception):
+            self.popup.live_var.set(False)
+            self.stop_live()
+            tk.messagebox.showwarning(title="Follow File", message="Stopped following the file: " + str(update))
+            return
+
+        if update:
+            self.append_live(live, *update)
+        self.popup.after(LIVE_POLL_MS, self.poll_live, live)
+
+    # Extends the lines and peak areas with the new rows only, the plot is redrawn once per poll
+    def append_live(self, live, restarted, groups):
+        ax = self.popup.fig.axes[0]
+        pixels = int(self.popup.fig.get_figwidth() * self.popup.fig.dpi)
+        per_pixel = max(live.stream.rows / pixels, 1)
+
+        # The first update replaces the plot of the whole file, a restart means the file was replaced
+        reset = restarted or not self.popup.live_started
+        self.popup.live_started = True
+        if reset:
+            ax.ignore_existing_data_limits = True
+
+        for i, ((index, values, peaks), (line, area)) in enumerate(zip(groups, self.popup.group_refs)):
+            x_new, y_new = decimate(index, values, max(int(len(values) / per_pixel), 1))
+            polygons = [peak_polygon(peak, live.stream.segment(i, peak[0], peak[1]), per_pixel) for peak in peaks if peak[1] > peak[0]]
+
+            if reset:
+                x, y = x_new, y_new
+            else:
+                x = np.concatenate((line.get_xdata(), x_new))
+                y = np.concatenate((line.get_ydata(), y_new))
+                polygons = [path.vertices for path in area.get_paths()] + polygons
+
+            # Many small polls are never decimated on their own, so the line is thinned again once it outgrows the plot
+            if len(x) > 8*pixels:
+                x, y = decimate(x, y, pixels)
+
+            line.set_data(x, y)
+            area.set_verts(polygons)
+            if len(x_new):
+                ax.update_datalim(np.column_stack((x_new, y_new)))
+
+            self.popup.labels[i].config(text=self.peak_label(i, len(live.stream.detectors[i].peaks)))
+
+        ax.autoscale_view()
+        self.popup.canvas.draw_idle()
+
+    def stop_live(self):
+        live = self.popup.live
+        self.popup.live = None
+        if live is None:
+            return
+
+        job, future = self.popup.live_poll or (None, None)
+        if job:
+            job.cancelled.set()
+        self.hand_over_live(live, self.popup.live_started, future)
+
+    # The followed data becomes the processed data when it was detected with the current settings. A poll that was
+    # running stops after its current chunk and the data is handed over once it has
+    def hand_over_live(self, live, started, future):
+        if future is not None and not future.done():
+            self.after(20, self.hand_over_live, live, started, future)
+            return
+        if not started or live.parameters != self.controller.parameters:
+            return
+
+        self.controller.set_group_pool(None)
+        self.controller.series_key = None
+        self.controller.processed_df = live.stream.processed_df()
+        self.set_processed(live.stream.processed_data(), self.controller.processed_df, live.parameters)
     
     def refresh(self):
         lines = []
@@ -664,29 +3265,47 @@ class Page3(Page_Template):
             for object in group[1]:
                 object.set_visible(group[0])
 
-        self.popup.canvas.draw()
+        if self.popup.background is None:
+            self.popup.canvas.draw()
+        else:
+            self.popup.canvas.restore_region(self.popup.background)
+            self.draw_groups()
+
+    def on_draw(self, event):
+        self.popup.background = self.popup.canvas.copy_from_bbox(self.popup.fig.bbox)
+        self.draw_groups()
+
+    def draw_groups(self):
+        ax = self.popup.fig.axes[0]
+        for group in self.popup.group_refs:
+            for object in group:
+                ax.draw_artist(object)
+        self.popup.canvas.blit(self.popup.fig.bbox)
 
 class Page4(Page_Template):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
         
-        self.columnconfigure(0, weight=1)
-        self.columnconfigure(1, weight=1)
+        for column in range(4):
+            self.columnconfigure(column, weight=1)
 
-        ttk.Label(self, text="Choose Output Data").grid(row=0, column=0, columnspan=2, pady=20)
+        ttk.Label(self, text="Choose Output Data").grid(row=0, column=0, columnspan=4, pady=20)
 
         self.checkboxes = []
         self.checkvars = []
 
+        # Two columns of statistics so they all fit on the page
+        rows = (len(self.controller.options_names) + 1) // 2
         for i, text in enumerate(self.controller.options_names):
-            ttk.Label(self, text=text).grid(sticky='E', row=i+1, column=0, padx=10, pady=10)
+            row, column = i % rows + 1, (i // rows) * 2
+            ttk.Label(self, text=text).grid(sticky='E', row=row, column=column, padx=10, pady=10)
             
             self.checkvars.append(tk.BooleanVar(value=False))
 
             controller.stat_flags.append(False)
 
             cb = ttk.Checkbutton(self, variable=self.checkvars[i], command=self.update_stats)
-            cb.grid(sticky='W', row=i+1, column=1, padx=10, pady=10)
+            cb.grid(sticky='W', row=row, column=column+1, padx=10, pady=10)
             self.checkboxes.append(cb)
 
     def on_enter(self):
@@ -719,29 +3338,53 @@ class Page5(Page_Template):
         self.display_box = ttk.Entry(self, textvariable=self.entry_text)
         self.display_box.grid(row=1, column=0, sticky="ew", pady=10, padx=10)
 
-        # copy button
-        ttk.Button(self, text="Copy Table", command=self.copy_to_clipboard).grid(row=2, column=0, pady=20, columnspan=2)
+        # also save every frame's group averages and the peak intervals
+        self.full_export = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self, text="Also save per-frame group averages and peak ranges", variable=self.full_export).grid(row=2, column=0, columnspan=2, sticky="w", padx=10)
+
+        # copy and compare buttons
+        buttons = ttk.Frame(self)
+        buttons.grid(row=3, column=0, pady=20, columnspan=2)
+        ttk.Button(buttons, text="Copy Table", command=self.copy_to_clipboard).pack(side="left", padx=10)
+        ttk.Button(buttons, text="Compare Specimens...", command=self.compare).pack(side="left", padx=10)
+        self.comparison = None
 
         # output preview frame
         self.frame = ttk.Frame(self)
-        self.frame.grid(row=3, column=0, sticky="ew", columnspan=2, pady=10)
+        self.frame.grid(row=4, column=0, sticky="ew", columnspan=2, pady=10)
 
         self.preview = None
         self.bind("<Configure>", lambda event: self.resize_preview(self.controller.winfo_width()))
     
     def on_enter(self):
         self.entry_text.set(self.controller.save_file_path)
-        self.controller.output_data = pd.DataFrame()
-        
-        for i, string in enumerate(self.controller.options_names):
-            if self.controller.stat_flags[i]:
-                for j, group in enumerate(self.controller.processed_data):
-                    stat = find_stats(group[0], group[1], string)
+        self.controller.output_data = None
+
+        processed_data = self.controller.processed_data
+        column_names = self.controller.column_names
+        stats = [string for i, string in enumerate(self.controller.options_names) if self.controller.stat_flags[i]]
+        parameters = dict(self.controller.parameters)
+        disk, series_key = self.controller.disk_cache, self.controller.series_key
+
+        def work(job):
+            with self.controller.trace.span("Page5.on_enter", columns=len(processed_data) * len(stats)) as info:
+                stats_key = disk.stats_key(disk.peaks_key(series_key, parameters), column_names, stats) if disk and series_key else None
+                output_data = disk.load_stats(stats_key) if stats_key else None
+                if output_data is None:
+                    output_data = build_output(processed_data, column_names, stats, progress=job.check)
+                    if stats_key:
+                        disk.save_stats(stats_key, output_data)
+                else:
+                    info["disk"] = True
+                if stats_key:
+                    disk.save_last(series_key, {"parameters": parameters, "stats": stats, "names": column_names, "time": time.strftime("%Y-%m-%d %H:%M")})
+                info["rows"] = len(output_data)
+            return output_data
 
-                    column_name = self.controller.column_names[j]
+        self.controller.run_job("Calculating statistics", work, self.set_output)
 
-                    self.controller.output_data[column_name + " " + string] = stat
-        
+    def set_output(self, output_data):
+        self.controller.output_data = output_data
         self.generate_preview()
     
     def generate_preview(self):
@@ -765,6 +3408,8 @@ class Page5(Page_Template):
         self.resize_preview(self.controller.winfo_width())
 
     def resize_preview(self, page_width):
+        if self.preview is None or self.controller.output_data is None:
+            return
         self.preview.pack_forget()
 
         cols = list(self.controller.output_data.columns)
@@ -776,7 +3421,7 @@ class Page5(Page_Template):
 
     def choose_location(self):
         new_loc = filedialog.asksaveasfilename(title="Select a destination location",
-                                                         filetypes=(("CSV files", "*.csv"),),
+                                                         filetypes=(("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("Excel workbooks", "*.xlsx")),
                                                          initialdir=self.controller.default_folder,
                                                          initialfile=self.controller.default_name,)
         if (new_loc != ""):
@@ -789,20 +3434,116 @@ class Page5(Page_Template):
         self.controller.default_name = os.path.basename(self.controller.save_file_path)
     
     def download_csv(self):
-        try:
-            self.controller.output_data.to_csv(self.controller.save_file_path, index=False)
-            tk.messagebox.showinfo(title="Download Successful", message="The file was successfully saved to your computer in the specified location.")
-        except:
-            tk.messagebox.showwarning(title="Save Failed", message="The output CSV file could not be saved at the specified location. Re-select a path and try again.")
+        if self.controller.output_data is None:
+            return
+
+        path = self.controller.save_file_path
+        output_data = self.controller.output_data
+        processed_data = self.controller.processed_data if self.full_export.get() else None
+        column_names = self.controller.column_names
+
+        # The per-frame table can be as long as the csv, so saving runs as a job
+        def work(job):
+            tables = export_tables(output_data, processed_data, column_names)
+            rows = sum(len(df) for df in tables.values())
+            with self.controller.trace.span("download_csv", rows=rows, columns=sum(df.shape[1] for df in tables.values())):
+                try:
+                    return write_tables(path, tables, progress=job.check)
+                except OSError:
+                    raise OSError("The output file could not be saved at the specified location. Re-select a path and try again.")
+
+        self.controller.run_job("Save", work, self.saved)
+
+    def saved(self, paths):
+        message = "The file was successfully saved to your computer in the specified location."
+        if len(paths) > 1:
+            message = "The files were successfully saved to your computer:\n" + "\n".join(os.path.basename(path) for path in paths)
+        tk.messagebox.showinfo(title="Download Successful", message=message)
     
-    def copy_to_clipboard(self):
-        copy_string = "\t".join(list(self.controller.output_data.columns))
+    # Run the same groups, settings and statistics on more files of the batch and compare them with this one
+    def compare(self):
+        if self.controller.output_data is None:
+            return
+        chosen = filedialog.askopenfilenames(title="Select the other specimens", filetypes=(("CSV files", "*.csv"),), initialdir=self.controller.default_folder)
+        if not chosen:
+            return
+
+        path = self.controller.csv_file_path
+        paths = [path] + [other for other in chosen if os.path.abspath(other) != os.path.abspath(path)]
+        all_columns = self.controller.all_columns
+        column_names = self.controller.column_names
+        aggregations = self.controller.aggregations
+        parameters = dict(self.controller.parameters)
+        stats = [string for i, string in enumerate(self.controller.options_names) if self.controller.stat_flags[i]]
+        dtype = self.controller.file_cache.dtype
+
+        def work(job):
+            with self.controller.trace.span("Page5.compare", files=len(paths), columns=len(all_columns)) as info:
+                results, failures = analyze_specimens(paths, all_columns, column_names, parameters, stats, dtype, progress=job.check, aggregations=aggregations)
+                if not results:
+                    raise ValueError("None of the specimens could be analyzed:\n" + "\n".join(f"{os.path.basename(p)}: {message}" for p, message in failures))
+                info["rows"] = sum(result["rows"] for result in results)
+                fig = plot_specimens(results, column_names, f"{len(results)} specimens")
+                return compare_specimens([result["table"] for result in results]), specimens_table(results), failures, fig
+
+        self.controller.run_job("Comparing specimens", work, self.show_comparison)
+
+    def show_comparison(self, result):
+        comparison, specimens, failures, fig = result
+        self.comparison = {"Comparison": comparison, "Specimens": specimens}
+
+        popup = Toplevel()
+        popup.title("Specimen Comparison")
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        popup.canvas = FigureCanvasTkAgg(fig, master=popup)
+        popup.canvas.draw()
+        popup.canvas.get_tk_widget().grid(row=0, column=0, columnspan=2, padx=10, pady=10)
+
+        columns = list(comparison.columns)
+        table = ttk.Treeview(popup, columns=columns, show="headings", height=min(len(comparison), 10))
+        for col in columns:
+            table.heading(col, text=col)
+            table.column(col, anchor="center", width=90)
+        for row in comparison.itertuples(index=False):
+            table.insert("", tk.END, values=[f"{val:.3f}" if isinstance(val, float) else val for val in row])
+        table.grid(row=1, column=0, columnspan=2, sticky="ew", padx=10)
+
+        scrollbar = ttk.Scrollbar(popup, orient="horizontal", command=table.xview)
+        table.configure(xscrollcommand=scrollbar.set)
+        scrollbar.grid(row=2, column=0, columnspan=2, sticky="ew", padx=10)
+
+        if failures:
+            ttk.Label(popup, text="Not compared:\n" + "\n".join(f"{os.path.basename(path)}: {message}" for path, message in failures),
+                      foreground="red", justify="left").grid(row=3, column=0, columnspan=2, sticky="w", padx=10, pady=5)
+
+        ttk.Button(popup, text="Save Comparison", command=self.save_comparison).grid(row=4, column=0, pady=10)
+        ttk.Button(popup, text="Close", command=popup.destroy).grid(row=4, column=1, pady=10)
+
+    def save_comparison(self):
+        path = filedialog.asksaveasfilename(title="Select a destination location",
+                                            filetypes=(("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("Excel workbooks", "*.xlsx")),
+                                            initialdir=self.controller.default_folder,
+                                            initialfile=os.path.splitext(os.path.basename(self.controller.csv_file_path))[0] + "_comparison.csv")
+        if path == "":
+            return
+        tables = self.comparison
+
+        def work(job):
+            try:
+                return write_tables(path, tables, progress=job.check)
+            except OSError:
+                raise OSError("The output file could not be saved at the specified location. Re-select a path and try again.")
 
-        for row in self.controller.output_data.itertuples(index=False):
-            copy_string += "\n" + "\t".join(list(map(str, row)))
+        self.controller.run_job("Save", work, self.saved)
 
-        ppc.copy(copy_string)
+    def copy_to_clipboard(self):
+        if self.controller.output_data is None:
+            return
+        with self.controller.trace.span("copy_to_clipboard", rows=len(self.controller.output_data), columns=self.controller.output_data.shape[1]):
+            import pyperclip
+            pyperclip.copy(table_tsv(self.controller.output_data))
         tk.messagebox.showinfo(title="Table Copied", message="The data summary table was copied to your clipboard. Paste into a spreadsheet.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import main
+
+ROWS = 700
+COLUMNS = 24
+
+def reference(matrix, group, spec):
+    values = matrix[:, group].astype(float)
+    kind, value = main.parse_aggregation(spec, len(group))
+    if kind == "mean":
+        return values.mean(axis=1)
+    if kind == "median":
+        return np.median(values, axis=1)
+    if kind == "trim":
+        cut = int(len(group) * value / 100)
+        return np.sort(values, axis=1)[:, cut:len(group) - cut].mean(axis=1)
+    weights = np.array(value)
+    return (values * weights).sum(axis=1) / weights.sum()
+
+def assert_matches_reference(matrix, groups, aggregations):
+    out = main.GroupAggregator(groups, aggregations).aggregate(matrix)
+    assert out.shape == (matrix.shape[0], len(groups))
+    for i, (group, spec) in enumerate(zip(groups, aggregations)):
+        np.testing.assert_allclose(out[:, i], reference(matrix, group, spec), rtol=1e-6 if matrix.dtype == np.float32 else 1e-12,
+                                   atol=1e-12, err_msg=spec)
+
+def random_matrix(dtype=float, seed=0):
+    return np.random.default_rng(seed).normal(1, 0.5, (ROWS, COLUMNS)).astype(dtype)
+
+# Many overlapping groups, the linear ones are combined with one membership product
+DENSE = [list(range(i, i + 9)) for i in range(0, 15)] + [[3, 1, 20, 7], [5], [0, 23]]
+# Few small groups that hardly overlap, each linear one is summed on its own
+SPARSE = [[0, 1], [2, 3, 4], [5], [9, 8, 7, 6, 10, 11], [12, 13, 14, 15, 16, 17, 18], [20, 19]]
+
+def specs(groups, kinds):
+    out = []
+    for i, group in enumerate(groups):
+        kind = kinds[i % len(kinds)]
+        out.append("weights:" + ",".join(str((j % 4) * 0.5 + (0 if j else 0.25)) for j in range(len(group))) if kind == "weights" else kind)
+    return out
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("groups, dense", [(DENSE, True), (SPARSE, False)], ids=["dense", "sparse"])
+@pytest.mark.parametrize("kinds", [["mean"], ["weights"], ["median"], ["trim:10"], ["trim:0"], ["trim:40"],
+                                   ["mean", "median", "weights", "trim:25"]])
+def test_aggregations_match_reference(groups, dense, kinds, dtype):
+    aggregations = specs(groups, kinds)
+    aggregator = main.GroupAggregator(groups, aggregations)
+    if aggregator.linear:
+        assert (aggregator.membership is not None) == dense
+    assert_matches_reference(random_matrix(dtype), groups, aggregations)
+
+# Median and trimmed groups sorted over several blocks of rows, the last one partial
+def test_sorted_in_blocks(monkeypatch):
+    monkeypatch.setattr(main, "SORT_BLOCK_BYTES", 8 * 9 * 7 * 3)
+    groups = [list(range(i, i + 9)) for i in range(7)] + [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert_matches_reference(random_matrix(), groups, ["median"] * 7 + ["trim:30", "median"])
+
+def test_ties_and_single_columns():
+    matrix = np.round(random_matrix(), 1)
+    groups = [[0], [1, 2], [3, 4, 5], [0, 1, 2, 3]]
+    assert_matches_reference(matrix, groups, ["median", "median", "trim:34", "weights:0,1,0,3"])
+
+def test_weights_need_positive_sum():
+    with pytest.raises(ValueError):
+        main.parse_aggregation("weights:0,0", 2)
+    with pytest.raises(ValueError):
+        main.parse_aggregation("weights:1,2", 3)
@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+GROUPS = [[1, 2, 3], [4, 5]]
+
+@pytest.fixture
+def disk(tmp_path):
+    return main.DiskCache(str(tmp_path / "cache"))
+
+def copy_sample(tmp_path, name="TestPogo.csv", to="exports"):
+    os.makedirs(tmp_path / to, exist_ok=True)
+    return shutil.copy(os.path.join(TEST_FILES, name), str(tmp_path / to / name))
+
+def frames(values, names=("a", "b")):
+    return [pd.DataFrame({name: pd.Series(np.asarray(values, dtype=float) + i, index=pd.RangeIndex(2, 2 + len(values)))})
+            for i, name in enumerate(names)]
+
+def test_series_key_follows_content_groups_dtype_and_aggregations(disk, tmp_path):
+    path = copy_sample(tmp_path)
+    copy = copy_sample(tmp_path, to="elsewhere")
+    key = disk.series_key(path, GROUPS, "float64", ["mean", "mean"])
+
+    # A copy on another path hits, anything that changes the averages misses
+    assert disk.series_key(copy, GROUPS, "float64", ["mean", "mean"]) == key
+    assert disk.series_key(path, [[1, 2], [4, 5]], "float64", ["mean", "mean"]) != key
+    assert disk.series_key(path, GROUPS, "float32", ["mean", "mean"]) != key
+    assert disk.series_key(path, GROUPS, "float64", ["median", "mean"]) != key
+    assert disk.series_key(copy_sample(tmp_path, "TestSine.csv"), GROUPS, "float64", ["mean", "mean"]) != key
+
+    with open(copy, "a") as f:
+        f.write(",".join(["1"] * 15) + "\n")
+    assert disk.series_key(copy, GROUPS, "float64", ["mean", "mean"]) != key
+
+def test_peaks_and_stats_keys(disk):
+    parameters = dict(main.DEFAULT_PARAMETERS)
+    peaks_key = disk.peaks_key("series", parameters)
+    assert disk.peaks_key("series", dict(parameters)) == peaks_key
+    assert disk.peaks_key("series", dict(parameters, Step=2)) != peaks_key
+    assert disk.peaks_key("other", parameters) != peaks_key
+    stats_key = disk.stats_key(peaks_key, ["a", "b"], ["Mean"])
+    assert disk.stats_key(peaks_key, ["a", "c"], ["Mean"]) != stats_key
+    assert disk.stats_key(peaks_key, ["a", "b"], ["Mean", "Area"]) != stats_key
+
+def test_entries_round_trip(disk):
+    processed_df = frames([0.0, 1.0, 1.0, 1.0, 0.0, 2.0, 2.0, 2.0, 0.0])
+    assert disk.load_series("k", ["a", "b"]) is None
+
+    disk.save_series("k", processed_df)
+    loaded = disk.load_series("k", ["a", "b"])
+    for result, expected in zip(loaded, processed_df):
+        pd.testing.assert_frame_equal(result, expected, check_index_type=False)
+    # A different number of groups is a miss
+    assert disk.load_series("k", ["a"]) is None
+
+    processed_data = main.process_groups(loaded, dict(main.DEFAULT_PARAMETERS))
+    disk.save_peaks("p", processed_data)
+    peaks = disk.load_peaks("p", loaded)
+    assert [group.peaks for group in peaks] == [group.peaks for group in processed_data]
+    assert [group.open_start for group in peaks] == [group.open_start for group in processed_data]
+
+    output = main.build_output(processed_data[:1], ["a"], main.OPTIONS_NAMES)
+    disk.save_stats("s", output)
+    pd.testing.assert_frame_equal(disk.load_stats("s"), output)
+
+    disk.save_last("k", {"parameters": main.DEFAULT_PARAMETERS, "stats": ["Mean"]})
+    assert disk.load_last("k")["stats"] == ["Mean"]
+    assert disk.counters["disk misses"] == 2 and disk.counters["disk hits"] == 4
+
+def test_least_recently_used_entries_are_evicted(disk):
+    entry = {"step": 1, "peaks": [[]], "open_start": [None]}
+    size = len(json.dumps(entry))
+    disk.max_bytes = 3 * size
+    processed_df = frames([1.0], ["a"])
+
+    for key in ["a", "b", "c"]:
+        disk.save_peaks(key, [main.ProcessedGroup(processed_df[0], [], None)])
+        time.sleep(0.01)
+    # Reading an entry marks it as used, so the oldest unread one goes first
+    assert disk.load_peaks("a", processed_df) is not None
+    disk.save_peaks("d", [main.ProcessedGroup(processed_df[0], [], None)])
+
+    assert [disk.load_peaks(key, processed_df) is not None for key in "abcd"] == [True, False, True, True]
+    assert disk.counters["evicted"] == 1
+    assert sum(size for _, size, _ in disk.entries()) <= disk.max_bytes
+
+def test_clear_removes_everything(disk, tmp_path):
+    disk.content_hash(copy_sample(tmp_path))
+    disk.save_last("k", {})
+    disk.clear()
+    assert os.listdir(disk.root) == []
+
+def test_hashes_survive_concurrent_writers(disk, tmp_path):
+    paths = [shutil.copy(os.path.join(TEST_FILES, "TestSine.csv"), str(tmp_path / f"{i}.csv")) for i in range(16)]
+    threads = [threading.Thread(target=disk.content_hash, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every thread's hash is kept, none is written over by another thread's older copy of the list
+    with open(os.path.join(disk.root, "hashes.json")) as f:
+        assert sorted(json.load(f)) == sorted(os.path.abspath(path) for path in paths)
+
+def test_hashes_of_deleted_files_are_dropped(disk, tmp_path):
+    gone = copy_sample(tmp_path, "TestSine.csv")
+    disk.content_hash(gone)
+    os.remove(gone)
+    kept = copy_sample(tmp_path)
+    disk.content_hash(kept)
+
+    with open(os.path.join(disk.root, "hashes.json")) as f:
+        assert list(json.load(f)) == [os.path.abspath(kept)]
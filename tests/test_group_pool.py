@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+
+def pogo():
+    groups = [list(range(0, 14)), [2, 3], [6], [4, 5, 6, 7, 8, 9], [1, 3, 5, 7, 9, 11, 13]]
+    columns, positions = main.select_columns([[c + 1 for c in group] for group in groups])
+    df_clean = main.clean_data(main.read_dic_csv(os.path.join(TEST_FILES, "TestPogo.csv"), usecols=columns))
+    return df_clean, positions, ["mean", "median", "mean", "trim:20", "weights:1,2,3,4,5,6,7"]
+
+# Long enough for several product blocks per worker, with many overlapping groups so the dense branch is used
+def synthetic():
+    rng = np.random.default_rng(1)
+    steps = np.repeat(rng.uniform(0, 5, 40), 150)
+    df_clean = pd.DataFrame(steps[:, None] + rng.normal(0, 0.01, (len(steps), 30)), index=pd.RangeIndex(3, 3 + len(steps)))
+    groups = [list(range(i, i + 12)) for i in range(0, 19)] + [[0, 29], [7]]
+    aggregations = ["mean"] * 17 + ["median", "weights:" + ",".join(["1", "2"] * 6), "trim:10", "mean"]
+    assert main.GroupAggregator(groups, aggregations).membership is not None
+    return df_clean, groups, aggregations
+
+@pytest.mark.parametrize("case", [pogo, synthetic])
+def test_pool_matches_single_core(case):
+    df_clean, groups, aggregations = case()
+    names = [f"Group {i}" for i in range(len(groups))]
+    expected_df = main.average_groups(df_clean, groups, names, aggregations)
+
+    pool = main.GroupPool(df_clean, groups, workers=2)
+    try:
+        assert pool.workers == 2
+        processed_df = pool.average(names, aggregations)
+        for result, expected in zip(processed_df, expected_df):
+            pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+        cache = main.ResultCache()
+        for detector in main.DETECTORS:
+            parameters = dict(main.DEFAULT_PARAMETERS, Detector=detector, Step=3)
+            expected_data = main.process_groups(expected_df, parameters)
+            # The second pass is answered from the cache without the workers
+            for _ in range(2):
+                processed_data = main.process_groups(processed_df, parameters, cache, pool=pool)
+                for result, expected in zip(processed_data, expected_data):
+                    assert result.peaks == expected.peaks
+                    assert result.open_start == expected.open_start
+                    pd.testing.assert_series_equal(result.states(), expected.states())
+        assert cache.hits == len(main.DETECTORS) * len(groups)
+    finally:
+        pool.close()
@@ -0,0 +1,69 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+GROUPS = [[1, 2, 3], [4, 5]]
+NAMES = ["Avg 1:3", "Avg 4:5"]
+
+def follow(live, progress=None):
+    update = live.poll(progress)
+    return update and [(index.copy(), values.copy(), list(peaks)) for index, values, peaks in update[1]]
+
+def assert_matches_stream(live, path):
+    expected = main.stream_file(path, GROUPS, NAMES, live.parameters).processed_data()
+    for result, reference in zip(live.stream.processed_data(), expected):
+        np.testing.assert_array_equal(result.data.to_numpy(), reference.data.to_numpy())
+        assert result.peaks == reference.peaks
+
+@pytest.mark.parametrize("chunksize", [1, 7, 100_000])
+def test_polls_follow_a_growing_file(tmp_path, chunksize):
+    source = open(os.path.join(TEST_FILES, "TestPogo.csv"), "rb").read()
+    path = str(tmp_path / "live.csv")
+    open(path, "wb").close()
+
+    live = main.LiveFile(path, GROUPS, NAMES, dict(main.DEFAULT_PARAMETERS), chunksize=chunksize)
+    assert live.poll() is None
+
+    # Partly written lines are left for the next poll
+    rows = 0
+    for start in range(0, len(source), 5000):
+        with open(path, "ab") as f:
+            f.write(source[start:start + 5000])
+        update = follow(live)
+        if update:
+            rows += len(update[0][0])
+            assert live.offset == source.rfind(b"\n", 0, start + 5000) + 1
+    assert live.poll() is None
+    assert rows == live.stream.rows
+    assert_matches_stream(live, os.path.join(TEST_FILES, "TestPogo.csv"))
+
+def test_replaced_file_is_read_again(tmp_path):
+    path = str(tmp_path / "live.csv")
+    shutil.copy(os.path.join(TEST_FILES, "TestPogo.csv"), path)
+    live = main.LiveFile(path, GROUPS, NAMES, dict(main.DEFAULT_PARAMETERS), chunksize=50)
+    live.poll()
+
+    shutil.copy(os.path.join(TEST_FILES, "TestSine.csv"), path)
+    restarted, groups = live.poll()
+    assert restarted
+    assert_matches_stream(live, path)
+
+# Stopping between chunks keeps what was fed, the next poll carries on from there
+def test_stopped_poll_resumes(tmp_path):
+    path = str(tmp_path / "live.csv")
+    shutil.copy(os.path.join(TEST_FILES, "TestPogo.csv"), path)
+    live = main.LiveFile(path, GROUPS, NAMES, dict(main.DEFAULT_PARAMETERS), chunksize=100)
+
+    def stop(progress):
+        raise main.JobCancelled()
+    with pytest.raises(main.JobCancelled):
+        live.poll(stop)
+    assert live.lines == 100
+
+    live.poll()
+    assert_matches_stream(live, path)
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+import main
+
+@pytest.mark.parametrize("spec, expected", [
+    ("3", [3]),
+    ("3,4:8", [3, 4, 5, 6, 7, 8]),
+    ("8:4", [4, 5, 6, 7, 8]),
+    ("0:14", list(range(15))),
+])
+def test_valid_ranges(spec, expected):
+    assert main.parse_column_range(spec, 15) == expected
+
+@pytest.mark.parametrize("spec, message", [
+    ("", "start and end with digits"),
+    (",2:8,10:", "start and end with digits"),
+    ("3;4-8", "only contain digits"),
+    ("2,,3", "followed by digits"),
+    ("1:8:3", "single colon"),
+    ("15", "out of bounds"),
+    ("3,2:7", "duplicate"),
+    ("3,1:20", "out of bounds"),
+    ("20,3,3", "duplicate"),
+    ("3,3,20", "out of bounds"),
+    ("99,2,,3", "followed by digits"),
+    ("10,12:14,13", "duplicate"),
+    ("10,12:20", "out of bounds"),
+])
+def test_errors(spec, message):
+    with pytest.raises(ValueError, match=message):
+        main.parse_column_range(spec, 15)
+
+# A huge range typed by mistake must fail right away instead of walking every number in it
+@pytest.mark.parametrize("spec, message", [("1:1000000000", "out of bounds"), ("5,1:1000000000", "out of bounds"),
+                                           ("1:1000000000,5,5", "duplicate")])
+def test_huge_range_is_bounded_by_column_count(spec, message):
+    start = time.perf_counter()
+    with pytest.raises(ValueError, match=message):
+        main.parse_column_range(spec, 15)
+    assert time.perf_counter() - start < 0.1
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+
+# Each statistic computed the way find_stats did it, one iloc slice per peak
+REFERENCES = {
+    "Middle": lambda data, start, end: data.iloc[(start + end) // 2, 0],
+    "Median": lambda data, start, end: data.iloc[start:end, 0].median(),
+    "Mean": lambda data, start, end: data.iloc[start:end, 0].mean(),
+    "Maximum": lambda data, start, end: data.iloc[start:end, 0].max(),
+    "Minimum": lambda data, start, end: data.iloc[start:end, 0].min(),
+    "Std Dev": lambda data, start, end: data.iloc[start:end, 0].std(),
+    "Duration": lambda data, start, end: end - start,
+    "Area": lambda data, start, end: np.trapezoid(data.iloc[start:end, 0].to_numpy()) if end > start else np.nan,
+}
+EXACT = ["Middle", "Median", "Maximum", "Minimum", "Duration"]
+
+def sample_groups(name):
+    df_clean = main.clean_data(main.read_dic_csv(os.path.join(TEST_FILES, name)))
+    for column in df_clean.columns[1:6]:
+        data = pd.DataFrame({column: df_clean[column]})
+        peaks = main.process_data(data, 1, 1.0, 0.5).peaks
+        assert peaks
+        # Empty peaks at the start, in the middle and on the last row, plus one and two row peaks
+        last = len(data) - 1
+        yield data, peaks + [(0, 0), (5, 5), (last, last), (7, 8), (10, 12), (0, len(data))]
+
+def assert_matches_slices(data, peaks):
+    result = main.peak_stats(data, peaks, main.OPTIONS_NAMES)
+    assert list(result) == main.OPTIONS_NAMES
+    for stat in main.OPTIONS_NAMES:
+        expected = [REFERENCES[stat](data, start, end) for start, end in peaks]
+        assert len(result[stat]) == len(peaks)
+        if stat in EXACT:
+            np.testing.assert_array_equal(result[stat], expected, err_msg=stat)
+        else:
+            np.testing.assert_allclose(result[stat], expected, rtol=1e-12, atol=1e-12, err_msg=stat)
+
+@pytest.mark.parametrize("name", ["TestSine.csv", "TestPogo.csv"])
+def test_sample_files_match_slices(name):
+    for data, peaks in sample_groups(name):
+        assert_matches_slices(data, peaks)
+
+def test_only_empty_peaks():
+    data = pd.DataFrame({"x": [1.0, 2.0, 3.0]})
+    assert_matches_slices(data, [(1, 1), (2, 2)])
+
+def test_no_peaks():
+    data = pd.DataFrame({"x": [1.0, 2.0, 3.0]})
+    assert main.peak_stats(data, [], main.OPTIONS_NAMES) == {stat: [] for stat in main.OPTIONS_NAMES}
+
+def test_find_stats_is_one_statistic():
+    data, peaks = next(sample_groups("TestPogo.csv"))
+    stats = main.peak_stats(data, peaks, ["Mean", "Maximum"])
+    np.testing.assert_array_equal(main.find_stats(data, peaks, "Maximum"), stats["Maximum"])
+    np.testing.assert_array_equal(main.find_stats(data, peaks, "Mean"), stats["Mean"])
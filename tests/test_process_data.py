@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+STEPS = range(1, 51)
+SAMPLE_STEPS = [1, 2, 7, 50]
+THRESHOLDS = [(0.0, 0.0), (0.0015, 0.005), (0.15, 0.5), (1.0, 5.0)]
+
+# The first, a middle and the last column of a sample export, cleaned and in percent like the app groups them
+def sample_columns(name):
+    df_clean = main.clean_data(main.read_dic_csv(os.path.join(TEST_FILES, name)))
+    columns = df_clean.columns[[0, len(df_clean.columns) // 2, -1]]
+    return [pd.DataFrame({column: df_clean[column]}) for column in columns]
+
+# Short series shaped like the sample exports: noisy plateaus, a sine and a walk that often holds still
+def synthetic_columns():
+    rng = np.random.default_rng(0)
+    plateaus = np.repeat(rng.uniform(0, 5, 8), rng.integers(3, 15, 8))
+    plateaus = plateaus + rng.normal(0, 0.002, len(plateaus))
+    sine = 2 * np.sin(np.linspace(0, 6 * np.pi, 90)) + rng.normal(0, 0.005, 90)
+    walk = 10 + np.cumsum(rng.normal(0, 1, 90) * (rng.random(90) < 0.3))
+    return [pd.DataFrame({"x": values}) for values in (plateaus, sine, walk)]
+
+def assert_matches_loop(data, step, change_sense, zero_threshold):
+    expected, expected_peaks = main.process_data_loop(data, step, change_sense, zero_threshold)
+    result = main.process_data(data, step, change_sense, zero_threshold)
+
+    assert result.peaks == expected_peaks
+    assert all(type(i) is int for peak in result.peaks for i in peak)
+    pd.testing.assert_series_equal(result.states(), expected["state"], check_names=False)
+    pd.testing.assert_frame_equal(result.labeled(), expected)
+
+@pytest.mark.parametrize("name", ["TestSine.csv", "TestPogo.csv"])
+@pytest.mark.parametrize("change_sense, zero_threshold", THRESHOLDS)
+def test_sample_files_match_loop(name, change_sense, zero_threshold):
+    for data in sample_columns(name):
+        for step in SAMPLE_STEPS:
+            assert_matches_loop(data, step, change_sense, zero_threshold)
+
+# Every Step is swept on short series, where the loop reference stays fast
+@pytest.mark.parametrize("change_sense, zero_threshold", THRESHOLDS)
+def test_synthetic_series_match_loop(change_sense, zero_threshold):
+    for data in synthetic_columns():
+        for step in STEPS:
+            assert_matches_loop(data, step, change_sense, zero_threshold)
+
+EDGE_CASES = {
+    "one row": [1.0],
+    "constant": [2.0] * 12,
+    "all zero": [0.0] * 6,
+    "nan rows": [1.0, np.nan, 1.0, 1.0, np.nan, np.nan, 1.0, 1.0],
+    "open run at end": [0.0, 3.0, 6.0, 6.0, 6.0, 6.0, 6.0],
+    "run closed by zero": [1.0, 1.0, 1.0, 0.0, 1.0, 1.0],
+    "short tail": [1.0, 1.0, 1.0, 5.0, 5.0, 5.0, 5.0, 9.0, 9.0, 9.0, 9.0],
+}
+
+@pytest.mark.parametrize("values", EDGE_CASES.values(), ids=EDGE_CASES.keys())
+@pytest.mark.parametrize("step", [1, 2, 3, 5, 50])
+@pytest.mark.parametrize("change_sense, zero_threshold", THRESHOLDS)
+def test_edge_cases_match_loop(values, step, change_sense, zero_threshold):
+    assert_matches_loop(pd.DataFrame({"x": values}), step, change_sense, zero_threshold)
+
+def test_open_run_is_kept():
+    result = main.process_data(pd.DataFrame({"x": [0.0, 3.0, 6.0, 6.0, 6.0, 6.0]}), 1, 0.15, 0.5)
+    assert result.peaks == []
+    assert result.open_start == 3
+    assert list(result.states()) == ["changing", "changing", "flat", "flat", "flat", None]
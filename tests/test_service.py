@@ -0,0 +1,139 @@
+import http.client
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+POGO = os.path.join(TEST_FILES, "TestPogo.csv")
+TOKEN = "test-token"
+
+# One service and server for the module, starting and stopping a server takes half a second
+@pytest.fixture(scope="module")
+def plot_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("plots"))
+
+@pytest.fixture(scope="module")
+def service(plot_dir):
+    service = main.AnalysisService(workers=2, plot_dir=plot_dir)
+    yield service
+    service.close()
+
+@pytest.fixture(scope="module")
+def port(service):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), main.service_handler(service, TOKEN))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_port
+    server.shutdown()
+    server.server_close()
+
+def send(port, method="POST", path="/analyze", body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    default = {"Host": f"127.0.0.1:{port}", "Authorization": "Bearer " + TOKEN, "Content-Type": "application/json"}
+    data = None if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+    connection.request(method, path, body=data, headers={key: value for key, value in dict(default, **(headers or {})).items() if value is not None})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+REQUEST = {"path": POGO, "groups": ["1:14=All", "3"], "stats": ["Mean"]}
+
+def test_client_with_token(port, service):
+    requests = service.requests
+    response = main.ServiceClient(f"http://127.0.0.1:{port}", token=TOKEN).analyze(REQUEST)
+    assert response["groups"] == ["All", "P1"]
+    assert response["table"]["columns"] == ["All Mean", "P1 Mean"]
+    assert main.ServiceClient(f"http://127.0.0.1:{port}", token=TOKEN).status()["requests"] == requests + 1
+
+@pytest.mark.parametrize("headers, code", [
+    ({"Authorization": None}, 401),
+    ({"Authorization": "Bearer wrong"}, 401),
+    ({"Authorization": TOKEN}, 401),
+    ({"Origin": "http://example.com"}, 403),
+    ({"Origin": "null"}, 403),
+    ({"Host": "example.com"}, 403),
+    ({"Content-Type": "text/plain"}, 415),
+    ({"Content-Type": "application/x-www-form-urlencoded"}, 415),
+    ({"Content-Type": None}, 415),
+])
+def test_refused_requests(port, service, headers, code):
+    requests = service.requests
+    status, body = send(port, body=REQUEST, headers=headers)
+    assert status == code and "error" in body
+    assert service.requests == requests
+
+def test_status_needs_token(port):
+    assert send(port, "GET", "/status", headers={"Authorization": None, "Content-Type": None})[0] == 401
+    assert send(port, "GET", "/status", headers={"Origin": "http://example.com"})[0] == 403
+    assert send(port, "GET", "/status")[0] == 200
+
+def test_client_with_wrong_token(port):
+    with pytest.raises(ValueError, match="token"):
+        main.ServiceClient(f"http://127.0.0.1:{port}", token="wrong").analyze(REQUEST)
+
+@pytest.mark.parametrize("change", [
+    {"groups": [3]},
+    {"groups": "3"},
+    {"groups": ["3", None]},
+    {"groups": {"3": "x"}},
+    {"stats": "Mean"},
+    {"stats": [1]},
+    {"stats": ["Average"]},
+    {"path": 3},
+    {"path": ["a"]},
+    {"parameters": []},
+    {"parameters": {"Step": 0}},
+    {"parameters": {"Step": 2.5}},
+    {"parameters": {"Step": float("inf")}},
+    {"parameters": {"Window": 501}},
+    {"parameters": {"Slope Threshold": -1}},
+    {"parameters": {"Zero Threshold": "0.5"}},
+    {"parameters": {"Zero Threshold": True}},
+    {"parameters": {"Detector": "Fastest"}},
+    {"parameters": {"Detector": ["Slope"]}},
+    {"parameters": {"Speed": 1}},
+    {"plot": 3},
+])
+def test_bad_requests(port, change):
+    body = json.dumps(dict(REQUEST, **change), allow_nan=True).encode()
+    status, response = send(port, body=body)
+    assert status == 400, response
+
+def test_not_json(port):
+    assert send(port, body=b"{not json")[0] == 400
+
+def test_plot_inside_plot_dir(port, plot_dir):
+    status, response = send(port, body=dict(REQUEST, plot="pogo.png"))
+    assert status == 200
+    assert response["plot"] == os.path.join(os.path.realpath(plot_dir), "pogo.png")
+    assert os.path.getsize(response["plot"]) > 0
+
+@pytest.mark.parametrize("name", ["../escape.png", "sub/../../escape.png", "/tmp/escape.png", "."])
+def test_plot_path_stays_in_plot_dir(service, name):
+    with pytest.raises(ValueError):
+        service.plot_path(name)
+
+def test_plot_path_follows_links(service, plot_dir, tmp_path):
+    os.symlink(str(tmp_path), os.path.join(plot_dir, "out"))
+    with pytest.raises(ValueError):
+        service.plot_path("out/escape.png")
+    assert service.plot_path("inside.png") == os.path.join(os.path.realpath(plot_dir), "inside.png")
+
+def test_plots_off_without_plot_dir():
+    service = main.AnalysisService(workers=1)
+    try:
+        with pytest.raises(ValueError, match="--plot-dir"):
+            service.plot_path("pogo.png")
+    finally:
+        service.close()
+
+def test_escaping_plot_is_refused_over_http(port, tmp_path):
+    status, response = send(port, body=dict(REQUEST, plot=str(tmp_path / "escape.png")))
+    assert status == 400
+    assert not os.path.exists(tmp_path / "escape.png")
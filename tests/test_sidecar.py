@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+
+def copy_sample(tmp_path):
+    path = str(tmp_path / "exports" / "TestPogo.csv")
+    os.makedirs(os.path.dirname(path))
+    shutil.copy(os.path.join(TEST_FILES, "TestPogo.csv"), path)
+    return path
+
+def test_sidecars_are_kept_per_dtype_in_the_cache(tmp_path):
+    path = copy_sample(tmp_path)
+    disk = main.DiskCache(str(tmp_path / "cache"))
+
+    loads = [main.load_csv(path, disk, dtype) for dtype in ["float64", "float32", "float64", "float32"]]
+    assert [from_sidecar for _, from_sidecar in loads] == [False, False, True, True]
+    assert [df.dtypes.iloc[0] for df, _ in loads] == [np.float64, np.float32, np.float64, np.float32]
+    pd.testing.assert_frame_equal(loads[0][0], loads[2][0])
+    pd.testing.assert_frame_equal(loads[0][0], main.read_dic_csv(path))
+    assert loads[0][0].attrs["quantities"] == loads[2][0].attrs["quantities"]
+
+    # Nothing is written next to the export
+    assert os.listdir(os.path.dirname(path)) == ["TestPogo.csv"]
+    assert sorted(name.partition(".")[2] for name in os.listdir(disk.root) if "sidecar" in name) == ["sidecar.json"] * 2 + ["sidecar.npy"] * 2
+
+def test_changed_csv_is_parsed_again(tmp_path):
+    path = copy_sample(tmp_path)
+    disk = main.DiskCache(str(tmp_path / "cache"))
+    main.load_csv(path, disk)
+
+    with open(path, "a") as f:
+        f.write(",".join(["1"] * 15) + "\n")
+    df, from_sidecar = main.load_csv(path, disk)
+    assert not from_sidecar
+    assert df.shape[0] == main.read_dic_csv(path).shape[0]
+    assert main.load_csv(path, disk)[1]
+
+def test_sidecars_are_evicted_with_the_cache(tmp_path):
+    path = copy_sample(tmp_path)
+    disk = main.DiskCache(str(tmp_path / "cache"), max_bytes=1024)
+
+    # Bigger than the whole cache, so it is never saved
+    df, from_sidecar = main.load_csv(path, disk)
+    assert not from_sidecar and df.shape == (431, 15)
+    assert not any("sidecar" in name for name in os.listdir(disk.root))
+
+    disk.max_bytes = 1024**2
+    main.load_csv(path, disk)
+    assert main.load_csv(path, disk)[1]
+    disk.clear()
+    assert not main.load_csv(path, disk)[1]
@@ -0,0 +1,41 @@
+import os
+
+import pandas as pd
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+
+# Overlapping groups so the aggregator's shared columns and every kind of aggregation are exercised
+GROUPS = [[1, 2, 3, 4, 5], [2, 3], [7], [0, 6, 8, 9, 10, 11], [3, 4, 5, 6, 7, 8, 9]]
+NAMES = ["Avg 1:5", "Avg 2:3", "P2", "Avg 0,6,8:11", "Avg 3:9"]
+AGGREGATIONS = {
+    "mean": ["mean"] * 5,
+    "median": ["median"] * 5,
+    "trim": ["trim:20"] * 5,
+    "mixed": ["median", "mean", "trim:10", "trim:25", "weights:1,2,3,4,5,6,7"],
+}
+
+def whole_file(path, parameters, aggregations):
+    columns, groups = main.select_columns(GROUPS)
+    df_clean = main.clean_data(main.read_dic_csv(path, usecols=columns))
+    return main.process_groups(main.average_groups(df_clean, groups, NAMES, aggregations), parameters)
+
+@pytest.mark.parametrize("name", ["TestSine.csv", "TestPogo.csv"])
+@pytest.mark.parametrize("detector", main.DETECTORS)
+@pytest.mark.parametrize("aggregation", AGGREGATIONS)
+def test_stream_matches_whole_file(name, detector, aggregation):
+    path = os.path.join(TEST_FILES, name)
+    aggregations = AGGREGATIONS[aggregation]
+    parameters = dict(main.DEFAULT_PARAMETERS, Detector=detector, Step=2, Window=7)
+    expected = whole_file(path, parameters, aggregations)
+
+    for chunksize in [1, 7, 64, 10_000]:
+        stream = main.stream_file(path, GROUPS, NAMES, parameters, chunksize, aggregations=aggregations)
+        assert stream.rows == expected[0].data.shape[0]
+        for result, reference in zip(stream.processed_data(), expected):
+            pd.testing.assert_frame_equal(result.data, reference.data, check_exact=True, check_index_type=False)
+            assert result.peaks == reference.peaks
+            assert result.open_start == reference.open_start
+            pd.testing.assert_series_equal(result.states(), reference.states(), check_index_type=False)
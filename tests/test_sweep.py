@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+import main
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-files")
+
+def group_averages(name, groups):
+    columns, positions = main.select_columns(groups)
+    df_clean = main.clean_data(main.read_dic_csv(os.path.join(TEST_FILES, name), usecols=columns))
+    return main.average_groups(df_clean, positions, [str(group) for group in groups])
+
+# TestPogo.csv has 8 plateaus, coarse Steps merge them and must not outvote the finer ones
+@pytest.mark.parametrize("groups", [[list(range(3, 9)), [5], [9, 10]], [list(range(1, 15)), [3]]], ids=["3:8,5,9:10", "1:14,3"])
+def test_auto_tune_finds_every_plateau(groups):
+    processed_df = group_averages("TestPogo.csv", groups)
+    best = main.sweep_parameters(processed_df, workers=2)[0]
+
+    assert best["agreement"] == 1
+    assert best["counts"] == (8,) * len(groups)
+    processed_data = main.process_groups(processed_df, dict(main.DEFAULT_PARAMETERS, **best["parameters"]))
+    assert [len(group.peaks) for group in processed_data] == [8] * len(groups)
+
+def test_support_counts_each_step_once():
+    grid = [[0.1, 0.2], [0.0], [1, 21]]
+    # Step 1 agrees on 8 peaks once, Step 21 agrees on 4 peaks at both thresholds
+    counts = {(0, 0, 0): (8, 8), (1, 0, 0): (8, 9), (0, 0, 1): (4, 4), (1, 0, 1): (4, 4)}
+    ranked = main.rank_grid(grid, counts)
+    support = {r["index"]: r["support"] for r in ranked}
+    assert support[(0, 0, 0)] == support[(0, 0, 1)] == 0.5